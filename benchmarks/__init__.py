@@ -0,0 +1,11 @@
+#
+# workon benchmarks
+#
+# generate builds a synthetic home directory (configuration, live and
+# archived contexts, years of time tracking, access history) and run
+# times workon commands against it end to end, as separate processes.
+#
+#   python -m benchmarks.generate /tmp/workon-bench --contexts 5000 --archived 1000
+#   python -m benchmarks.run /tmp/workon-bench --output results.json
+#   python -m benchmarks.run /tmp/workon-bench --compare results.json
+#
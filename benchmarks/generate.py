@@ -0,0 +1,153 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from datetime import date,timedelta
+
+MANIFEST_FILE='benchmark.json'
+LIVE_PREFIX='bench-'
+ARCHIVED_PREFIX='archived-'
+
+#
+# Synthetic home directory
+#
+# Everything is written through workon's own modules, so the data is in
+# the format of the workon being benchmarked. workon reads its
+# configuration from $HOME, which is pointed at the target directory
+# before the first workon import.
+#
+def context_names(prefix, count):
+    width = max(5, len(str(count)))
+    return ['{}{:0{}d}'.format(prefix, i, width) for i in range(count)]
+
+def definition(apps):
+    # Stand-in applications that start instantly and run until closed
+    ctx = {}
+    for i in range(apps):
+        ctx['app{}'.format(i)] = {'command': '/bin/sleep', 'args': '86400'}
+    return ctx
+
+def write_contexts(names, apps, file_size, session):
+    from workon import context
+
+    notes = b'x' * file_size
+    for name in names:
+        context.write_context(session.context_file(name), definition(apps))
+        os.makedirs(session.support_dir(name), exist_ok=True)
+        with open(os.path.join(session.support_dir(name), 'notes.txt'), 'wb') as fp:
+            fp.write(notes)
+
+def write_time_spent(names, years, per_day, rng, session):
+    from workon import storage,rollup
+
+    first = date.today() - timedelta(days=int(years * 365))
+    rows = {}
+    day = first
+    while day <= date.today():
+        for name in rng.sample(names, min(per_day, len(names))):
+            rows[(name, int(day.strftime('%Y%m%d')))] = rng.uniform(60, 4 * 3600)
+        day = day + timedelta(days=1)
+
+    with storage.transaction(session) as connection:
+        connection.executemany('INSERT OR REPLACE INTO time_spent(context, date, spent) VALUES(?, ?, ?)',
+                               [(name, day, spent) for (name,day),spent in rows.items()])
+    rollup.rebuild(connection)
+    return (int(first.strftime('%Y%m%d')), len(rows))
+
+def write_history(names, accesses, years, rng, session):
+    from workon import storage,history
+
+    now = time.time()
+    start = now - years * 365 * 86400
+    # Skewed towards a few favourites, as real use is
+    weights = [1.0 / (i + 1) for i in range(len(names))]
+    events = sorted((rng.uniform(start, now), name) for name in rng.choices(names, weights, k=accesses))
+
+    last = {}
+    for ts,name in events:
+        last[name] = ts
+    history.write_history(last, session)
+
+    with storage.transaction(session) as connection:
+        connection.execute('DELETE FROM access_log')
+        connection.executemany('INSERT INTO access_log(context, ts) VALUES(?, ?)',
+                               [(name, ts) for ts,name in events])
+        connection.execute('DELETE FROM catalog_meta WHERE key=?', ('frecency_rate',))
+    history.ensure_frecency(session)
+
+def generate(target, contexts, archived, years, per_day, accesses, apps, file_size, seed):
+    target = os.path.abspath(target)
+    if os.path.exists(os.path.join(target, MANIFEST_FILE)):
+        raise SystemExit('{} already holds benchmark data'.format(target))
+    os.makedirs(target, exist_ok=True)
+
+    context_dir = os.path.join(target, '.context')
+    with open(os.path.join(target, '.workon.cfg'), 'w') as fp:
+        json.dump({'context_dir': context_dir, 'shutdown_grace': 1.0}, fp)
+
+    os.environ['HOME'] = target
+    os.environ['WORKON_SOCKET'] = os.path.join(target, 'workon.sock')
+    from workon import config,cli,catalog,archive
+
+    rng = random.Random(seed)
+    session = config.get_session()
+    cli.bootstrap(session)
+
+    started = time.monotonic()
+    live = context_names(LIVE_PREFIX, contexts)
+    old = context_names(ARCHIVED_PREFIX, archived)
+    write_contexts(live + old, apps, file_size, session)
+    print('{} contexts written ({:.1f}s)'.format(len(live) + len(old), time.monotonic() - started))
+
+    first_day,days = write_time_spent(live + old, years, per_day, rng, session)
+    print('{} time_spent rows written ({:.1f}s)'.format(days, time.monotonic() - started))
+
+    if len(live) > 0 and accesses > 0:
+        write_history(live, accesses, years, rng, session)
+        print('{} accesses written ({:.1f}s)'.format(accesses, time.monotonic() - started))
+
+    catalog.reconcile(session, full=True)
+    if len(old) > 0:
+        archive.move_to_archive(ARCHIVED_PREFIX + '*', session)
+        print('{} contexts archived ({:.1f}s)'.format(len(old), time.monotonic() - started))
+
+    manifest = {
+        'contexts': contexts,
+        'archived': archived,
+        'years': years,
+        'contexts_per_day': per_day,
+        'time_spent_rows': days,
+        'first_day': first_day,
+        'accesses': accesses,
+        'apps': apps,
+        'file_size': file_size,
+        'seed': seed,
+        'live_prefix': LIVE_PREFIX,
+        'archived_prefix': ARCHIVED_PREFIX,
+    }
+    with open(os.path.join(target, MANIFEST_FILE), 'w') as fp:
+        json.dump(manifest, fp, indent=2)
+    return manifest
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic workon home directory for benchmarking.')
+    parser.add_argument('target', help='Directory to create; used as $HOME by the benchmark runner')
+    parser.add_argument('--contexts', type=int, default=1000, help='Number of live contexts')
+    parser.add_argument('--archived', type=int, default=200, help='Number of archived contexts')
+    parser.add_argument('--years', type=float, default=5, help='Years of time tracking and access history')
+    parser.add_argument('--contexts-per-day', dest='per_day', type=int, default=8,
+                        help='Contexts with time recorded on each day')
+    parser.add_argument('--accesses', type=int, default=50000, help='Number of context switches in the history')
+    parser.add_argument('--apps', type=int, default=3, help='Applications (sleep stand-ins) per context')
+    parser.add_argument('--file-size', dest='file_size', type=int, default=4096,
+                        help='Size in bytes of the file in each support directory')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    args = parser.parse_args(argv)
+
+    generate(args.target, args.contexts, args.archived, args.years, args.per_day, args.accesses, args.apps,
+             args.file_size, args.seed)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,206 @@
+import os
+import sys
+import json
+import time
+import signal
+import platform
+import argparse
+import statistics
+import subprocess
+from datetime import date
+
+from benchmarks import generate
+
+REPO_DIR=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DAEMON_START_TIMEOUT=10.0
+
+#
+# Scenarios
+#
+# Each scenario is a list of steps for one iteration. A step is a label
+# and the workon arguments; steps labelled None prepare or clean up and
+# are not timed. Iterations rotate through the contexts so that every
+# timed command sees the same amount of work.
+#
+def scenarios(manifest, iteration):
+    width = max(5, len(str(manifest['contexts'])))
+    count = max(1, manifest['contexts'])
+
+    def live(offset):
+        return '{}{:0{}d}'.format(manifest['live_prefix'], (iteration * 2 + offset) % count, width)
+
+    today = date.today().strftime('%Y%m%d')
+    return {
+        'startup': [('startup', ['--help'])],
+        'list': [('list', ['-l'])],
+        'list_verbose': [('list_verbose', ['-lv'])],
+        'list_archive': [('list_archive', ['--list-archive'])],
+        'show': [('show', ['-s'])],
+        'switch': [
+            ('switch', [live(0)]),
+            ('switch_replace', [live(1)]),
+            ('close', ['-c']),
+        ],
+        'time_spent': [('time_spent', ['--time-spent', '--date-begin', str(manifest['first_day']),
+                                       '--date-end', today])],
+        'time_spent_by_month': [('time_spent_by_month', ['--time-spent', '--group-by', 'month',
+                                                         '--date-begin', str(manifest['first_day']),
+                                                         '--date-end', today])],
+        'archive': [
+            ('archive', ['--archive', live(0)]),
+            ('restore', ['--restore', live(0)]),
+        ],
+        'function': [('function', ['-f', 'kanban', live(0)])],
+        'function_bulk': [('function_bulk', ['-f', 'kanban', manifest['live_prefix'] + '*0'])],
+    }
+
+#
+# Running workon
+#
+def workon_env(target):
+    env = dict(os.environ)
+    env['HOME'] = target
+    env['WORKON_SOCKET'] = os.path.join(target, 'workon.sock')
+    env['PYTHONPATH'] = os.pathsep.join([REPO_DIR] + [p for p in env.get('PYTHONPATH', '').split(os.pathsep) if p])
+    env.setdefault('EDITOR', 'true')
+    return env
+
+def run_workon(argv, env):
+    import tempfile
+
+    # Launched applications inherit the output files, so errors go to a
+    # file rather than a pipe that would stay open while they run
+    with tempfile.TemporaryFile() as errors:
+        started = time.perf_counter()
+        proc = subprocess.run([sys.executable, '-m', 'workon'] + argv, env=env, cwd=env['HOME'],
+                              stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=errors)
+        elapsed = time.perf_counter() - started
+        if proc.returncode != 0:
+            errors.seek(0)
+            print('workon {} exited with status {}: {}'.format(' '.join(argv), proc.returncode,
+                                                              errors.read().decode(errors='replace').strip()),
+                  file=sys.stderr)
+    return elapsed,proc.returncode
+
+def start_daemon(env):
+    proc = subprocess.Popen([sys.executable, '-m', 'workon', '--daemon'], env=env, cwd=env['HOME'],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + DAEMON_START_TIMEOUT
+    while os.path.exists(env['WORKON_SOCKET']) == False:
+        if proc.poll() != None or time.monotonic() > deadline:
+            proc.kill()
+            raise SystemExit('workon daemon did not start')
+        time.sleep(0.05)
+    return proc
+
+def stop_daemon(proc):
+    proc.send_signal(signal.SIGTERM)
+    try:
+        proc.wait(DAEMON_START_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+def summarize(samples):
+    ms = sorted(sample * 1000 for sample in samples)
+    return {
+        'samples': len(ms),
+        'min_ms': ms[0],
+        'median_ms': statistics.median(ms),
+        'mean_ms': statistics.mean(ms),
+        'p90_ms': ms[min(len(ms) - 1, int(len(ms) * 0.9))],
+        'max_ms': ms[-1],
+        'stdev_ms': statistics.stdev(ms) if len(ms) > 1 else 0.0,
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def benchmark(target, repeat, warmup, selected, daemon):
+    target = os.path.abspath(target)
+    with open(os.path.join(target, generate.MANIFEST_FILE)) as fp:
+        manifest = json.load(fp)
+
+    env = workon_env(target)
+    names = selected or list(scenarios(manifest, 0))
+    for name in names:
+        if name not in scenarios(manifest, 0):
+            raise SystemExit('Unknown scenario {}'.format(name))
+    samples = {}
+    failures = {}
+
+    proc = start_daemon(env) if daemon else None
+    try:
+        for name in names:
+            for iteration in range(warmup + repeat):
+                for label,argv in scenarios(manifest, iteration)[name]:
+                    elapsed,status = run_workon(argv, env)
+                    if label == None or iteration < warmup:
+                        continue
+                    samples.setdefault(label, []).append(elapsed)
+                    if status != 0:
+                        failures[label] = failures.get(label, 0) + 1
+            print('{:.<24} done'.format(name), file=sys.stderr)
+    finally:
+        if proc != None:
+            stop_daemon(proc)
+
+    results = {}
+    for label,values in samples.items():
+        results[label] = summarize(values)
+        results[label]['failures'] = failures.get(label, 0)
+
+    return {
+        'commit': git_commit(),
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'mode': 'daemon' if daemon else 'direct',
+        'repeat': repeat,
+        'data': manifest,
+        'results': results,
+    }
+
+def compare(previous, current):
+    print('{:<24} {:>12} {:>12} {:>8}'.format('benchmark', 'before (ms)', 'after (ms)', 'change'))
+    for label,stats in current['results'].items():
+        before = previous['results'].get(label)
+        if before == None:
+            print('{:<24} {:>12} {:>12.2f}'.format(label, '-', stats['median_ms']))
+            continue
+        change = (stats['median_ms'] / before['median_ms'] - 1) * 100 if before['median_ms'] > 0 else 0.0
+        print('{:<24} {:>12.2f} {:>12.2f} {:>+7.1f}%'.format(label, before['median_ms'], stats['median_ms'], change))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time workon commands end to end against generated data.')
+    parser.add_argument('target', help='Directory created by benchmarks.generate')
+    parser.add_argument('--repeat', type=int, default=10, help='Timed iterations per scenario')
+    parser.add_argument('--warmup', type=int, default=1, help='Untimed iterations per scenario')
+    parser.add_argument('--scenario', dest='scenarios', action='append',
+                        help='Run only this scenario (may be repeated)')
+    parser.add_argument('--daemon', action='store_true', default=False,
+                        help='Start a workon daemon for the data and time the served commands')
+    parser.add_argument('--output', help='Write the results as JSON to this file (default: standard output)')
+    parser.add_argument('--compare', help='Results of an earlier run to compare medians against')
+    args = parser.parse_args(argv)
+
+    results = benchmark(args.target, args.repeat, args.warmup, args.scenarios, args.daemon)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+    elif args.compare == None:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as fp:
+            compare(json.load(fp), results)
+
+if __name__ == '__main__':
+    sys.exit(main())
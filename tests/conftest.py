@@ -0,0 +1,20 @@
+import os
+import json
+import pytest
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    # A workon session whose home and context directory are a fresh
+    # temporary directory; the database is created on first use
+    from workon import config,storage
+
+    context_dir = os.path.join(str(tmp_path), '.context')
+    os.mkdir(context_dir)
+    with open(os.path.join(str(tmp_path), '.workon.cfg'), 'w') as fp:
+        json.dump({'context_dir': context_dir}, fp)
+
+    monkeypatch.setenv('HOME', str(tmp_path))
+    config.reset_session()
+    yield config.get_session()
+    storage.close_connections()
+    config.reset_session()
@@ -0,0 +1,87 @@
+import os
+import sys
+import json
+import stat
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run_workon(home, *argv):
+    env = dict(os.environ)
+    env['HOME'] = str(home)
+    env['WORKON_SOCKET'] = os.path.join(str(home), 'workon.sock')
+    env['PYTHONPATH'] = REPO_DIR
+    code = 'import sys\nfrom workon import cli\ncli.main(sys.argv[1:])'
+    return subprocess.run([sys.executable, '-c', code] + list(argv), env=env, cwd=str(home),
+                          capture_output=True, text=True)
+
+def make_context(tmp_path):
+    context_dir = os.path.join(str(tmp_path), '.context')
+    with open(os.path.join(str(tmp_path), '.workon.cfg'), 'w') as fp:
+        json.dump({'context_dir': context_dir}, fp)
+    assert run_workon(tmp_path, '-l').returncode == 0
+
+    with open(os.path.join(context_dir, 'proj.json'), 'w') as fp:
+        json.dump({'Kanban': {'command': '/bin/true'}}, fp)
+    os.chmod(os.path.join(context_dir, 'proj.json'), 0o640)
+
+    support_dir = os.path.join(context_dir, 'proj.files')
+    os.makedirs(os.path.join(support_dir, 'private'))
+    os.chmod(os.path.join(support_dir, 'private'), 0o700)
+    with open(os.path.join(support_dir, 'private', 'notes.txt'), 'w') as fp:
+        fp.write('private notes\n')
+    os.chmod(os.path.join(support_dir, 'private', 'notes.txt'), 0o600)
+    with open(os.path.join(support_dir, 'run.sh'), 'w') as fp:
+        fp.write('#!/bin/sh\n')
+    os.chmod(os.path.join(support_dir, 'run.sh'), 0o755)
+    os.symlink('private/notes.txt', os.path.join(support_dir, 'notes'))
+    return context_dir
+
+def tree(path):
+    entries = {}
+    for root,dirs,files in os.walk(path):
+        for name in dirs + files:
+            full = os.path.join(root, name)
+            st = os.lstat(full)
+            rel = os.path.relpath(full, path)
+            if stat.S_ISLNK(st.st_mode):
+                entries[rel] = ('link', os.readlink(full))
+            elif stat.S_ISDIR(st.st_mode):
+                entries[rel] = ('dir', stat.S_IMODE(st.st_mode))
+            else:
+                with open(full) as fp:
+                    entries[rel] = ('file', stat.S_IMODE(st.st_mode), fp.read())
+    return entries
+
+def test_archive_restore_round_trip(tmp_path):
+    context_dir = make_context(tmp_path)
+    support_dir = os.path.join(context_dir, 'proj.files')
+    before = tree(support_dir)
+    before_mode = stat.S_IMODE(os.stat(support_dir).st_mode)
+
+    proc = run_workon(tmp_path, '--archive', 'proj')
+    assert proc.returncode == 0, proc.stderr
+    assert os.path.exists(os.path.join(context_dir, 'archive', 'proj.tar.xz'))
+    assert os.path.exists(support_dir) == False
+
+    proc = run_workon(tmp_path, '--restore', 'proj')
+    assert proc.returncode == 0, proc.stderr
+    assert 'Error' not in proc.stdout
+    assert tree(support_dir) == before
+    assert stat.S_IMODE(os.stat(support_dir).st_mode) == before_mode
+    assert stat.S_IMODE(os.stat(os.path.join(context_dir, 'proj.json')).st_mode) == 0o640
+    with open(os.path.join(context_dir, 'proj.json')) as fp:
+        assert json.load(fp) == {'Kanban': {'command': '/bin/true'}}
+
+def test_unsafe_link_is_archived_as_plain_files(tmp_path):
+    context_dir = make_context(tmp_path)
+    os.symlink('/etc/hostname', os.path.join(context_dir, 'proj.files', 'outside'))
+
+    proc = run_workon(tmp_path, '--archive', 'proj')
+    assert proc.returncode == 0, proc.stderr
+    assert os.path.exists(os.path.join(context_dir, 'archive', 'proj.tar.xz')) == False
+    assert os.readlink(os.path.join(context_dir, 'archive', 'proj.files', 'outside')) == '/etc/hostname'
+
+    proc = run_workon(tmp_path, '--restore', 'proj')
+    assert proc.returncode == 0, proc.stderr
+    assert os.readlink(os.path.join(context_dir, 'proj.files', 'outside')) == '/etc/hostname'
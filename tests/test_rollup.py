@@ -0,0 +1,57 @@
+import os
+import json
+import random
+from datetime import date,timedelta
+from workon import storage,tracking,rollup,report
+
+CONTEXTS = ['alpha', 'beta', 'gamma']
+FIRST_DAY = date(2023, 11, 20)
+DAYS = 900
+
+def period(day, group_by):
+    if group_by == 'day':
+        return day
+    elif group_by == 'week':
+        return rollup.buckets(day)[2][1]
+    elif group_by == 'month':
+        return day // 100
+    return None
+
+def expected_report(connection, begin, end, group_by):
+    totals = {}
+    for ctx,day,spent in connection.execute('SELECT context, date, spent FROM time_spent WHERE date>=? AND date<=?',
+                                            (begin, end)):
+        key = (period(day, group_by), ctx)
+        totals[key] = totals.get(key, 0) + spent
+    return totals
+
+def test_range_report_matches_daily_rows(session):
+    for ctx in CONTEXTS:
+        with open(os.path.join(session.context_dir, ctx + '.json'), 'w') as fp:
+            json.dump({}, fp)
+
+    # Spent times are multiples of half a second, so sums are exact in any order
+    rand = random.Random(1234)
+    connection = storage.get_connection(session)
+    for n in range(DAYS):
+        day = rollup.to_int(FIRST_DAY + timedelta(days=n))
+        for ctx in CONTEXTS:
+            if rand.random() < 0.6:
+                tracking.accumulate_time_spent(connection, ctx, day, rand.randint(1, 20000) / 2)
+    storage.commit(connection)
+    assert rollup.verify(connection) == []
+
+    ranges = [(0, DAYS - 1), (0, 0), (40, 40)]
+    for n in range(150):
+        first = rand.randrange(DAYS)
+        ranges.append((first, min(DAYS - 1, first + rand.choice([3, 20, 60, 200, 800]))))
+        ranges.append(tuple(sorted([rand.randrange(DAYS), rand.randrange(DAYS)])))
+
+    for first,last in ranges:
+        begin = rollup.to_int(FIRST_DAY + timedelta(days=first))
+        end = rollup.to_int(FIRST_DAY + timedelta(days=last))
+        for group_by in report.GROUPINGS:
+            rows = report.time_spent_report(begin, end, group_by, session=session)
+            have = {(row['period'], row['context']): row['spent'] for row in rows}
+            assert len(have) == len(rows), (begin, end, group_by)
+            assert have == expected_report(connection, begin, end, group_by), (begin, end, group_by)
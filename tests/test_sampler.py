@@ -0,0 +1,65 @@
+from workon import process,sampler,context
+
+class FakeDaemon:
+    def __init__(self):
+        self.stop_hooks = []
+
+    def call_later(self, delay, callback):
+        pass
+
+def run_samples(monkeypatch, samples):
+    # Each sample is (uptime, {pid: (ppid, pgid, cpu, started, rss, read, write)})
+    monkeypatch.setattr(context, 'read_current_context', lambda session: {'build': {'make': [100, 0.0, 50]}})
+    monkeypatch.setattr(context, 'read_hibernated', lambda session: {})
+
+    s = sampler.Sampler(FakeDaemon())
+    for uptime,procs in samples:
+        monkeypatch.setattr(sampler, 'read_uptime', lambda: uptime)
+        monkeypatch.setattr(process, 'snapshot', lambda: {pid: entry[:5] for pid,entry in procs.items()})
+        monkeypatch.setattr(process, 'io_bytes', lambda pid: procs[pid][5:])
+        s.take_sample(None)
+
+    usage = list(s.pending.values())[0]
+    return round(usage[0] * process.CLK_TCK), usage[4], usage[5]
+
+def test_reaped_child_is_charged_once(monkeypatch):
+    samples = [
+        # Baseline: the application and a child it started
+        (1000, {100: (1, 100, 10, 50, 1, 1000, 0),
+                101: (100, 100, 5, 900, 1, 10, 0)}),
+        # The child has used 300 ticks and read 5000 bytes since
+        (2000, {100: (1, 100, 12, 50, 1, 1000, 0),
+                101: (100, 100, 305, 900, 1, 5010, 0)}),
+        # The child ran for 15 more ticks, then was reaped: its totals
+        # are now part of the application's
+        (3000, {100: (1, 100, 13 + 320, 50, 1, 1000 + 5100, 0)}),
+    ]
+    cpu,read_bytes,write_bytes = run_samples(monkeypatch, samples)
+    assert cpu == (2 + 300) + (1 + 15)
+    assert read_bytes == 5000 + 90
+    assert write_bytes == 0
+
+def test_short_lived_child_is_charged_through_its_parent(monkeypatch):
+    samples = [
+        (1000, {100: (1, 100, 10, 50, 1, 0, 0)}),
+        # A child started and was reaped between the samples
+        (2000, {100: (1, 100, 10 + 40, 50, 1, 0, 700)}),
+    ]
+    cpu,read_bytes,write_bytes = run_samples(monkeypatch, samples)
+    assert cpu == 40
+    assert write_bytes == 700
+
+def test_nested_children_reaped_in_one_interval(monkeypatch):
+    samples = [
+        (1000, {100: (1, 100, 10, 50, 1, 0, 0),
+                101: (100, 100, 1, 900, 1, 0, 0),
+                102: (101, 100, 1, 950, 1, 0, 0)}),
+        (2000, {100: (1, 100, 10, 50, 1, 0, 0),
+                101: (100, 100, 2, 900, 1, 0, 0),
+                102: (101, 100, 201, 950, 1, 0, 0)}),
+        # 102 ran 10 more ticks and was reaped by 101, which ran 1 more
+        # tick and was reaped by the application
+        (3000, {100: (1, 100, 10 + (3 + 211), 50, 1, 0, 0)}),
+    ]
+    cpu,read_bytes,write_bytes = run_samples(monkeypatch, samples)
+    assert cpu == (1 + 200) + (1 + 10)
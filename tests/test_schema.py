@@ -0,0 +1,101 @@
+import os
+import json
+import sqlite3
+import pytest
+from datetime import date,timedelta
+from workon import schema,storage,rollup,context,history
+
+def legacy_db(session, rows):
+    # The table as created by workon before the schema was versioned
+    connection = sqlite3.connect(session.time_track_db)
+    connection.execute('CREATE TABLE time_spent(context NOT NULL, date NOT NULL, spent, PRIMARY KEY(context,date))')
+    connection.executemany('INSERT INTO time_spent(context, date, spent) VALUES(?, ?, ?)', rows)
+    connection.commit()
+    connection.close()
+
+def write_legacy(session, name, data):
+    with open(os.path.join(session.context_dir, name), 'w') as fp:
+        json.dump(data, fp)
+
+def test_migrate_baseline_database(session):
+    legacy_db(session, [
+        ('foo', 20260105, '100.5'),
+        # The same day with the date stored as text; merged on migration
+        ('foo', '20260105', 50),
+        ('bar', 20260102, 30),
+        ('bar', 20251231, '12'),
+    ])
+    write_legacy(session, '.current_context.json', {'foo': {'Kanban': 4242}})
+    write_legacy(session, '.timers.json', {'foo': 1700000200.0})
+    write_legacy(session, '.history.json', {'foo': 1700000000.0, 'bar': '1700000100.5'})
+    write_legacy(session, '.hibernated.json', {})
+
+    connection = storage.get_connection(session)
+
+    assert schema.schema_version(connection) == schema.SCHEMA_VERSION
+    assert schema.column_types(connection, 'time_spent')['spent'] == 'REAL'
+    rows = connection.execute('SELECT context, date, spent, typeof(date), typeof(spent) FROM time_spent '
+                              'ORDER BY context, date').fetchall()
+    assert rows == [
+        ('bar', 20251231, 12.0, 'integer', 'real'),
+        ('bar', 20260102, 30.0, 'integer', 'real'),
+        ('foo', 20260105, 150.5, 'integer', 'real'),
+    ]
+
+    assert rollup.verify(connection) == []
+    rollups = {(span, bucket, ctx): spent for span,bucket,ctx,spent in
+               connection.execute('SELECT span, bucket, context, spent FROM time_spent_rollup')}
+    assert rollups[('year', 2026, 'foo')] == 150.5
+    assert rollups[('month', 202601, 'bar')] == 30.0
+    assert rollups[('year', 2025, 'bar')] == 12.0
+    # The week spans the turn of the year
+    assert rollups[('week', 20251229, 'bar')] == 42.0
+
+    assert context.read_current_context(session) == {'foo': {'Kanban': [4242, None, None]}}
+    assert connection.execute('SELECT context, started FROM timers').fetchall() == [('foo', 1700000200.0)]
+    hist = history.read_history(session)
+    assert float(hist['foo']) == 1700000000.0
+    assert float(hist['bar']) == 1700000100.5
+
+    for name in ('.current_context.json', '.timers.json', '.history.json', '.hibernated.json'):
+        assert os.path.exists(os.path.join(session.context_dir, name)) == False
+        assert os.path.exists(os.path.join(session.context_dir, name + '.imported'))
+
+def test_interrupted_migration_resumes(session):
+    days = [int((date(2020, 1, 1) + timedelta(days=n)).strftime('%Y%m%d')) for n in range(120)]
+    keys = [('ctx{}'.format(i % 50), days[i // 50]) for i in range(6000)]
+    rows = [(ctx, day, str(float(n))) for n,(ctx,day) in enumerate(keys)]
+    # The same keys again with the date stored as text, in later rowids
+    rows = rows + [(ctx, str(day), float(n)) for n,(ctx,day) in enumerate(keys)]
+    legacy_db(session, rows)
+    assert len(rows) > schema.MIGRATION_BATCH
+
+    # Abort the migration once the first batch has been copied
+    connection = sqlite3.connect(session.time_track_db)
+    connection.execute('CREATE TABLE time_spent_v1(context TEXT NOT NULL, date INTEGER NOT NULL, '
+                       'spent REAL NOT NULL DEFAULT 0, PRIMARY KEY(context, date)) WITHOUT ROWID')
+    connection.execute('CREATE TABLE interrupt(x)')
+    connection.execute('INSERT INTO interrupt VALUES(1)')
+    connection.execute('CREATE TRIGGER interrupt_copy BEFORE INSERT ON time_spent_v1 '
+                       'WHEN EXISTS(SELECT 1 FROM interrupt) AND (SELECT COUNT(*) FROM time_spent_v1)>={} '
+                       'BEGIN SELECT RAISE(ABORT, \'interrupted\'); END'.format(schema.MIGRATION_BATCH))
+    connection.commit()
+    with pytest.raises(sqlite3.DatabaseError):
+        schema.migrate(connection, session.time_track_db)
+    connection.rollback()
+
+    assert schema.schema_version(connection) == 0
+    assert connection.execute('SELECT last_rowid FROM schema_migration').fetchall() == [(schema.MIGRATION_BATCH,)]
+    assert connection.execute('SELECT COUNT(*) FROM time_spent_v1').fetchone()[0] == schema.MIGRATION_BATCH
+
+    connection.execute('DROP TRIGGER interrupt_copy')
+    connection.execute('DROP TABLE interrupt')
+    connection.commit()
+    connection.close()
+
+    connection = storage.get_connection(session)
+    assert schema.schema_version(connection) == schema.SCHEMA_VERSION
+    assert schema.table_exists(connection, 'schema_migration') == False
+    spent = {(ctx, day): value for ctx,day,value in connection.execute('SELECT context, date, spent FROM time_spent')}
+    assert spent == {key: 2.0 * n for n,key in enumerate(keys)}
+    assert rollup.verify(connection) == []
@@ -0,0 +1,59 @@
+import os
+import sys
+import json
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that only some commands need; none may be imported at startup
+HEAVY_MODULES = ('numpy', 'sqlite3', 'shutil', 'importlib', 'tarfile', 'lzma', 'tempfile', 'subprocess',
+                 'concurrent.futures')
+
+def run_python(code, home):
+    env = dict(os.environ)
+    env['HOME'] = str(home)
+    env['WORKON_SOCKET'] = os.path.join(str(home), 'workon.sock')
+    env['PYTHONPATH'] = REPO_DIR
+    return subprocess.run([sys.executable, '-c', code], env=env, cwd=str(home), capture_output=True, text=True)
+
+def make_home(tmp_path):
+    with open(os.path.join(str(tmp_path), '.workon.cfg'), 'w') as fp:
+        json.dump({'context_dir': os.path.join(str(tmp_path), '.context')}, fp)
+    return tmp_path
+
+def test_import_cli_is_light(tmp_path):
+    home = make_home(tmp_path)
+    proc = run_python('import sys, json\n'
+                      'import workon.cli\n'
+                      'print(json.dumps([m for m in {!r} if m in sys.modules]))'.format(HEAVY_MODULES), home)
+    assert proc.returncode == 0, proc.stderr
+    assert json.loads(proc.stdout.splitlines()[-1]) == []
+
+def test_bootstrap_skipped_when_stamp_matches(tmp_path):
+    home = make_home(tmp_path)
+    first = run_python('from workon import cli\n'
+                       'cli.main(["-s"])', home)
+    assert first.returncode == 0, first.stderr
+    assert os.path.exists(os.path.join(str(home), '.context', '.bootstrap'))
+
+    second = run_python('import sys\n'
+                        'from workon import cli\n'
+                        'def bootstrap(session):\n'
+                        '    sys.exit("bootstrap ran")\n'
+                        'cli.bootstrap = bootstrap\n'
+                        'cli.main(["-s"])', home)
+    assert second.returncode == 0, second.stderr
+
+def test_bootstrap_runs_when_stamp_differs(tmp_path):
+    home = make_home(tmp_path)
+    os.mkdir(os.path.join(str(home), '.context'))
+    with open(os.path.join(str(home), '.context', '.bootstrap'), 'w') as fp:
+        fp.write('0.0')
+
+    proc = run_python('import sys\n'
+                      'from workon import cli\n'
+                      'def bootstrap(session):\n'
+                      '    sys.exit("bootstrap ran")\n'
+                      'cli.bootstrap = bootstrap\n'
+                      'cli.main(["-s"])', home)
+    assert 'bootstrap ran' in proc.stderr
@@ -1,53 +1,322 @@
 import os
-import shutil
-from workon import config
+import time
+import hashlib
+import collections
+from workon import config,catalog,storage
 
-ARCHIVE_DIR='archive'
+ARCHIVE_DIR=config.ARCHIVE_DIR
+ARCHIVE_FORMAT='packed'
+ARCHIVE_PRESET=6
+BLOCK_SIZE=8 * 1024 * 1024
+READ_SIZE=1024 * 1024
 
 #
 # Archive storage
 #
-def get_archive():
-    context_list = []
+def get_archive(session=None):
+    if session is None:
+        session = config.get_session()
 
-    cfg = config.read_config()
-    arcdir = os.path.join(cfg['context_dir'], ARCHIVE_DIR)
-    for f in os.listdir(arcdir):
-        if f[0] != '.' and os.path.splitext(f)[1] == '.json':
-            context_list.append(os.path.splitext(f)[0])
+    context_list = []
+    for name,last_access in catalog.list_contexts(session, archived=True):
+        context_list.append(name)
 
     return context_list
 
+def read_manifest(session=None):
+    connection = storage.get_connection(session)
+    manifest = {}
+    for row in connection.execute('SELECT name, archived_at, size, packed_size, files, checksum FROM archive_manifest'):
+        manifest[row[0]] = row[1:]
+    return manifest
+
+def worker_count(session):
+    return max(1, int(session.cfg.get('archive_threads', os.cpu_count() or 1)))
+
+#
+# Packed archives
+#
+# With archive_format "packed" (the default) a context is archived as one
+# <name>.tar.xz bundle holding its definition and support directory, and
+# described by a row in the archive_manifest table, so listing the archive
+# never opens a bundle. Set archive_format to "directory" to move the
+# files into the archive directory uncompressed instead; contexts holding
+# links that leave the context, or device files, are always moved so.
+#
+# The tar stream is cut into BLOCK_SIZE blocks that are compressed as
+# independent xz streams on a thread pool (lzma releases the GIL) and
+# written in order. Concatenated xz streams are a valid .xz file, so the
+# bundles can also be unpacked with tar -xJf. Restoring decompresses and
+# extracts in one pass into a staging directory, checks the checksum and
+# only then moves the files into place.
+#
+class BlockWriter:
+    def __init__(self, fp, executor, preset, window):
+        self.fp = fp
+        self.executor = executor
+        self.preset = preset
+        self.window = window
+        self.buffer = bytearray()
+        self.pending = collections.deque()
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.packed_size = 0
+
+    def write(self, data):
+        self.buffer += data
+        self.size = self.size + len(data)
+        while len(self.buffer) >= BLOCK_SIZE:
+            self.submit(bytes(self.buffer[:BLOCK_SIZE]))
+            del self.buffer[:BLOCK_SIZE]
+        return len(data)
+
+    def submit(self, block):
+        import lzma
+
+        self.pending.append(self.executor.submit(lzma.compress, block, preset=self.preset))
+        # Bound the memory held by blocks waiting to be written
+        while len(self.pending) > self.window:
+            self.write_block()
+
+    def write_block(self):
+        data = self.pending.popleft().result()
+        self.fp.write(data)
+        self.digest.update(data)
+        self.packed_size = self.packed_size + len(data)
+
+    def close(self):
+        if len(self.buffer) > 0:
+            self.submit(bytes(self.buffer))
+            self.buffer = bytearray()
+        while len(self.pending) > 0:
+            self.write_block()
+
+class HashingReader:
+    def __init__(self, fp):
+        self.fp = fp
+        self.digest = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fp.read(size)
+        self.digest.update(data)
+        return data
+
+def pack_context(context, session, executor, window):
+    import tarfile
+    import tempfile
+
+    cfgfile = session.context_file(context)
+    support_dir = session.support_dir(context)
+    bundle = session.archive_bundle(context)
+    preset = int(session.cfg.get('archive_preset', ARCHIVE_PRESET))
+
+    files = [0]
+    def count(tarinfo):
+        files[0] = files[0] + 1
+        return check_member(tarinfo, context)
+
+    fd,tmpfile = tempfile.mkstemp(prefix='.' + os.path.basename(bundle) + '.', dir=session.archive_dir)
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            writer = BlockWriter(fp, executor, preset, window)
+            with tarfile.open(fileobj=writer, mode='w|', format=tarfile.PAX_FORMAT) as tar:
+                tar.add(cfgfile, arcname=os.path.basename(cfgfile), filter=count)
+                if os.path.exists(support_dir):
+                    tar.add(support_dir, arcname=os.path.basename(support_dir), filter=count)
+            writer.close()
+            fp.flush()
+            os.fsync(fp.fileno())
+        # mkstemp creates the file private; use the usual file mode
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmpfile, 0o666 & ~umask)
+        os.replace(tmpfile, bundle)
+    except BaseException:
+        try:
+            os.unlink(tmpfile)
+        except OSError:
+            pass
+        raise
+
+    return (time.time(), writer.size, writer.packed_size, files[0], writer.digest.hexdigest())
+
+def check_member(member, context):
+    import tarfile
+    import posixpath
+
+    # The same check runs when packing, so that a context is never
+    # archived in a form it could not be restored from
+    allowed = (context + '.json', context + '.files')
+    parts = member.name.split('/')
+    if parts[0] not in allowed or '..' in parts or os.path.isabs(member.name):
+        raise tarfile.TarError('unexpected member {}'.format(member.name))
+    if member.issym() or member.islnk():
+        # Symbolic links are relative to their directory, hard links to
+        # the top of the bundle; either must stay inside the context
+        target = member.linkname
+        if member.issym():
+            target = posixpath.join(posixpath.dirname(member.name), target)
+        if os.path.isabs(member.linkname) or posixpath.normpath(target).split('/')[0] not in allowed:
+            raise tarfile.TarError('unsafe link {} -> {}'.format(member.name, member.linkname))
+    elif member.isdev():
+        raise tarfile.TarError('device file {}'.format(member.name))
+    return member
+
+def checked_members(tar, context):
+    for member in tar:
+        yield check_member(member, context)
+
+def unpack_context(context, session, checksum):
+    import lzma
+    import shutil
+    import tarfile
+    import tempfile
+
+    staging = tempfile.mkdtemp(prefix='.restore-{}.'.format(context), dir=session.context_dir)
+    try:
+        with open(session.archive_bundle(context), 'rb') as raw:
+            reader = HashingReader(raw)
+            with lzma.open(reader) as fp:
+                with tarfile.open(fileobj=fp, mode='r|') as tar:
+                    # The members are checked already; the 'tar' filter
+                    # keeps their modes, which 'data' would normalise
+                    if hasattr(tarfile, 'tar_filter'):
+                        tar.extractall(staging, members=checked_members(tar, context), filter='tar')
+                    else:
+                        tar.extractall(staging, members=checked_members(tar, context))
+            while len(reader.read(READ_SIZE)) > 0:
+                pass
+
+        if checksum != None and reader.digest.hexdigest() != checksum:
+            raise ValueError('checksum mismatch in {}'.format(session.archive_bundle(context)))
+
+        for name in (context + '.json', context + '.files'):
+            if os.path.exists(os.path.join(staging, name)):
+                os.rename(os.path.join(staging, name), os.path.join(session.context_dir, name))
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+def run_parallel(function, contexts, session):
+    import concurrent.futures
+
+    # Contexts are packed or unpacked concurrently; the database is only
+    # updated from the calling thread
+    workers = worker_count(session)
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(workers) as blocks:
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            futures = {}
+            for context in contexts:
+                futures[context] = pool.submit(function, context, blocks, workers * 2)
+            for context,future in futures.items():
+                try:
+                    results[context] = future.result()
+                except Exception as e:
+                    results[context] = e
+    return results
+
+#
+# Archiving and restoring
+#
+def move_contexts(contexts, session):
+    import shutil
+
+    # archive_format "directory"
+    for name in contexts:
+        try:
+            shutil.move(session.context_file(name), session.archive_dir)
+            if os.path.exists(session.support_dir(name)):
+                shutil.move(session.support_dir(name), session.archive_dir)
+            catalog.set_archived(name, True, session)
+        except Exception as e:
+            print("Error archiving context: {} ({})".format(name, e))
+
+def move_to_archive(context, session=None):
+    import shutil
+
+    if session is None:
+        session = config.get_session()
 
-def move_to_archive(context):
     # Create archive directory, if it doesn't exist
-    cfg = config.read_config()
-    arcdir = os.path.join(cfg['context_dir'], ARCHIVE_DIR)
+    arcdir = session.archive_dir
     try:
         os.mkdir(arcdir)
     except:
         pass
 
-    cfgfile = os.path.join(cfg['context_dir'], context + '.json')
-    support_dir = os.path.join(cfg['context_dir'], context+'.files')
-    try:
-        shutil.move(cfgfile, arcdir)
-        if os.path.exists(support_dir):
-            shutil.move(support_dir, arcdir)
-    except Exception as e:
-        print("Error archiving context: {} ({})".format(context, e))
+    contexts = []
+    for name in catalog.select_contexts([context], False, session):
+        if os.path.exists(session.context_file(name)):
+            contexts.append(name)
+        else:
+            print("Error archiving context: {} (no such context)".format(name))
 
-def restore_from_archive(context):
-    # Create archive directory, if it doesn't exist
-    cfg = config.read_config()
-    arcfile = os.path.join(cfg['context_dir'], ARCHIVE_DIR, context + '.json')
-    support_dir = os.path.join(cfg['context_dir'], ARCHIVE_DIR, context+'.files')
+    if session.cfg.get('archive_format', ARCHIVE_FORMAT) != 'packed':
+        move_contexts(contexts, session)
+        return
 
-    try:
-        shutil.move(arcfile, cfg['context_dir'])
+    import tarfile
+
+    results = run_parallel(lambda name, blocks, window: pack_context(name, session, blocks, window),
+                           contexts, session)
+    unpackable = []
+    for name,result in results.items():
+        if isinstance(result, tarfile.TarError):
+            # Links leaving the context or device files could not be
+            # restored from a bundle; such contexts are moved as they are
+            print("Archiving context as plain files: {} ({})".format(name, result))
+            unpackable.append(name)
+            continue
+        if isinstance(result, Exception):
+            print("Error archiving context: {} ({})".format(name, result))
+            continue
+
+        with storage.transaction(session) as connection:
+            connection.execute('INSERT OR REPLACE INTO archive_manifest(name, archived_at, size, packed_size, files, '
+                               'checksum) VALUES(?, ?, ?, ?, ?, ?)', (name,) + result)
+            catalog.set_archived(name, True, session)
+        try:
+            os.remove(session.context_file(name))
+            shutil.rmtree(session.support_dir(name), ignore_errors=True)
+        except Exception as e:
+            print("Error removing archived context: {} ({})".format(name, e))
+
+    move_contexts(unpackable, session)
+
+def restore_from_archive(context, session=None):
+    import shutil
+
+    if session is None:
+        session = config.get_session()
+
+    manifest = read_manifest(session)
+    packed = []
+    for name in catalog.select_contexts([context], True, session):
+        if os.path.exists(session.context_file(name)):
+            print("Error restoring context: {} (already exists)".format(name))
+        elif os.path.exists(session.archive_bundle(name)):
+            packed.append(name)
+        else:
+            # Archived as plain files
+            try:
+                shutil.move(session.archive_file(name), session.context_dir)
+                if os.path.exists(session.archive_support_dir(name)):
+                    shutil.move(session.archive_support_dir(name), session.context_dir)
+                catalog.set_archived(name, False, session)
+            except Exception as e:
+                print("Error restoring context: {} ({})".format(name, e))
+
+    def unpack(name, blocks, window):
+        checksum = manifest[name][4] if name in manifest else None
+        unpack_context(name, session, checksum)
+
+    results = run_parallel(unpack, packed, session)
+    for name,result in results.items():
+        if isinstance(result, Exception):
+            print("Error restoring context: {} ({})".format(name, result))
+            continue
 
-        if os.path.exists(support_dir):
-            shutil.move(support_dir, cfg['context_dir'])
-    except Exception as e:
-        print("Error restoring context: {} ({})".format(context, e))
-    
+        with storage.transaction(session) as connection:
+            connection.execute('DELETE FROM archive_manifest WHERE name=?', (name,))
+            catalog.set_archived(name, False, session)
+        os.remove(session.archive_bundle(name))
@@ -0,0 +1,267 @@
+import os
+import time
+from workon import config,storage
+
+CATALOG_RESCAN_INTERVAL=600
+
+#
+# Context catalog
+#
+# The catalog is a table in the time tracking database that indexes every
+# live and archived context. The commands that create, archive, restore or
+# switch contexts keep it up to date, so listings never walk the context
+# directory. Definitions added or removed by hand are picked up by a
+# reconcile pass that runs when the catalog is empty, when it is older than
+# the configured rescan interval, or on request.
+#
+def connect(session=None):
+    return storage.get_connection(session)
+
+def scan_definitions(directory):
+    names = []
+    try:
+        for f in os.listdir(directory):
+            if f[0] != '.' and os.path.splitext(f)[1] == '.json':
+                names.append(os.path.splitext(f)[0])
+    except FileNotFoundError:
+        pass
+    return names
+
+def scan_bundles(directory):
+    names = []
+    try:
+        for f in os.listdir(directory):
+            if f[0] != '.' and f.endswith(config.ARCHIVE_BUNDLE_EXT):
+                names.append(f[:-len(config.ARCHIVE_BUNDLE_EXT)])
+    except FileNotFoundError:
+        pass
+    return names
+
+def archived_times(session, name):
+    # Packed archives have no definition file of their own
+    if os.path.exists(session.archive_file(name)):
+        return definition_times(session.archive_file(name))
+    return definition_times(session.archive_bundle(name))
+
+def definition_times(filename):
+    try:
+        st = os.stat(filename)
+        return (min(st.st_ctime, st.st_mtime), st.st_mtime)
+    except OSError:
+        now = time.time()
+        return (now, now)
+
+def reconcile(session=None, connection=None, full=False):
+    if session is None:
+        session = config.get_session()
+
+    if connection is None:
+        connection = connect(session)
+
+    cursor = connection.cursor()
+    if full:
+        cursor.execute('DELETE FROM catalog')
+        cursor.execute('DELETE FROM context_trigrams')
+
+    known = {}
+    for name,archived in cursor.execute('SELECT name, archived FROM catalog'):
+        known[name] = archived
+
+    on_disk = {}
+    for name in scan_bundles(session.archive_dir):
+        on_disk[name] = 1
+    for name in scan_definitions(session.archive_dir):
+        on_disk[name] = 1
+    for name in scan_definitions(session.context_dir):
+        on_disk[name] = 0
+
+    hist = None
+    for name,archived in on_disk.items():
+        if known.get(name) == archived:
+            continue
+
+        if hist is None:
+            from workon import history
+            hist = history.read_history(session)
+
+        if archived:
+            created,mtime = archived_times(session, name)
+        else:
+            created,mtime = definition_times(session.context_file(name))
+
+        try:
+            last_access = float(hist.get(name, 0))
+        except ValueError:
+            last_access = 0
+
+        cursor.execute('INSERT INTO catalog(name, archived, last_access, created, mtime) VALUES(?, ?, ?, ?, ?) '
+                       'ON CONFLICT(name) DO UPDATE SET archived=excluded.archived, mtime=excluded.mtime',
+                       (name, archived, last_access, created, mtime))
+        index_name(cursor, name)
+
+    for name in known:
+        if name not in on_disk:
+            cursor.execute('DELETE FROM catalog WHERE name=?', (name,))
+            cursor.execute('DELETE FROM context_trigrams WHERE name=?', (name,))
+
+    cursor.execute('INSERT OR REPLACE INTO catalog_meta(key, value) VALUES(?, ?)', ('synced_at', time.time()))
+    storage.commit(connection)
+
+    from workon import completion
+    completion.refresh(session)
+
+def needs_reconcile(session, connection):
+    res = connection.execute('SELECT value FROM catalog_meta WHERE key=?', ('synced_at',)).fetchone()
+    if res == None:
+        return True
+
+    interval = session.cfg.get('catalog_rescan_interval', CATALOG_RESCAN_INTERVAL)
+    return time.time() - float(res[0]) > interval
+
+def sync(session=None):
+    if session is None:
+        session = config.get_session()
+
+    connection = connect(session)
+    if needs_reconcile(session, connection):
+        reconcile(session, connection)
+
+    return connection
+
+def list_contexts(session=None, archived=False, top=None):
+    return ranked(sync(session), archived, top, session)
+
+def ranked(connection, archived=False, top=None, session=None):
+    from workon import history
+
+    history.ensure_frecency(session)
+
+    # Contexts ranked by frecency come straight off the access_history
+    # index (CROSS JOIN keeps it the outer loop, so there is no sort);
+    # contexts that were never opened follow in name order
+    limit = ''
+    params = [int(archived)]
+    if top != None:
+        limit = ' LIMIT ?'
+        params.append(int(top))
+
+    rows = connection.execute('SELECT catalog.name, catalog.last_access FROM access_history '
+                              'CROSS JOIN catalog ON catalog.name=access_history.context WHERE catalog.archived=? '
+                              'ORDER BY access_history.frecency DESC' + limit, params).fetchall()
+
+    if top == None or len(rows) < top:
+        if top != None:
+            params[-1] = int(top) - len(rows)
+        rows = rows + connection.execute('SELECT name, last_access FROM catalog WHERE archived=? '
+                                         'AND name NOT IN (SELECT context FROM access_history) '
+                                         'ORDER BY name' + limit, params).fetchall()
+
+    return rows
+
+#
+# Catalog updates
+#
+def add_context(context_name, session=None, archived=False):
+    if session is None:
+        session = config.get_session()
+
+    if archived:
+        created,mtime = archived_times(session, context_name)
+    else:
+        created,mtime = definition_times(session.context_file(context_name))
+
+    connection = connect(session)
+    connection.execute('INSERT INTO catalog(name, archived, created, mtime) VALUES(?, ?, ?, ?) '
+                       'ON CONFLICT(name) DO UPDATE SET archived=excluded.archived, mtime=excluded.mtime',
+                       (context_name, int(archived), created, mtime))
+    index_name(connection, context_name)
+    storage.commit(connection)
+
+    from workon import completion
+    completion.refresh(session)
+
+def set_archived(context_name, archived, session=None):
+    add_context(context_name, session, archived)
+
+def touch_context(context_name, access_time=None, session=None):
+    if session is None:
+        session = config.get_session()
+    if access_time is None:
+        access_time = time.time()
+
+    created,mtime = definition_times(session.context_file(context_name))
+
+    connection = connect(session)
+    connection.execute('INSERT INTO catalog(name, archived, last_access, created, mtime) VALUES(?, 0, ?, ?, ?) '
+                       'ON CONFLICT(name) DO UPDATE SET archived=0, last_access=excluded.last_access, '
+                       'mtime=excluded.mtime',
+                       (context_name, access_time, created, mtime))
+    index_name(connection, context_name)
+    storage.commit(connection)
+
+#
+# Name lookup
+#
+# Context names are indexed by their lower-case trigrams in
+# context_trigrams. resolve() accepts an exact name, a unique prefix (a
+# range scan on the catalog's primary key) or, for three characters or
+# more, a unique case-insensitive substring (the names holding every
+# trigram of the query).
+#
+def trigrams(name):
+    name = name.lower()
+    grams = set()
+    for i in range(len(name) - 2):
+        grams.add(name[i:i + 3])
+    return grams
+
+def index_name(connection, name):
+    connection.executemany('INSERT OR IGNORE INTO context_trigrams(trigram, name) VALUES(?, ?)',
+                           [(gram, name) for gram in trigrams(name)])
+
+def resolve(name, session=None, archived=False, limit=10):
+    connection = sync(session)
+    archived = int(archived)
+
+    res = connection.execute('SELECT name FROM catalog WHERE name=? AND archived=?', (name, archived)).fetchone()
+    if res != None or len(name) == 0:
+        return [name]
+
+    matches = [row[0] for row in connection.execute(
+        'SELECT name FROM catalog WHERE name>=? AND name<? AND archived=? ORDER BY name LIMIT ?',
+        (name, name + '\U0010ffff', archived, limit))]
+    if len(matches) > 0:
+        return matches
+
+    grams = trigrams(name)
+    if len(grams) == 0:
+        return []
+
+    command = ('SELECT context_trigrams.name FROM context_trigrams CROSS JOIN catalog '
+               'ON catalog.name=context_trigrams.name WHERE trigram IN ({}) AND catalog.archived=? '
+               'GROUP BY context_trigrams.name HAVING COUNT(*)=? ORDER BY context_trigrams.name').format(
+                   ', '.join('?' * len(grams)))
+    matches = []
+    for (candidate,) in connection.execute(command, list(grams) + [archived, len(grams)]):
+        if name.lower() in candidate.lower():
+            matches.append(candidate)
+            if len(matches) == limit:
+                break
+    return matches
+
+def select_contexts(patterns, archived=False, session=None):
+    import fnmatch
+
+    # Context names and shell patterns matched against the catalog, in the
+    # order given and without duplicates
+    names = []
+    listed = None
+    for pattern in patterns:
+        if any(c in pattern for c in '*?['):
+            if listed is None:
+                listed = [name for name,last_access in list_contexts(session, archived=archived)]
+            names.extend(sorted(fnmatch.filter(listed, pattern)))
+        elif len(pattern) > 0:
+            names.append(pattern)
+
+    return list(dict.fromkeys(names))
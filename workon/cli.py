@@ -0,0 +1,484 @@
+import json
+import os
+import sys
+import time
+import argparse
+from datetime import datetime,date,timedelta
+import workon
+from workon import config,context,history,tracking,archive,function,catalog,report,rollup,launcher,priority,storage,completion,snapshot,clone
+import re
+
+#
+# Path Helpers
+#
+def get_script_path():
+    return os.path.dirname(os.path.realpath(__file__))
+
+#
+# Time duration helper
+#
+duration_regex = re.compile(r'((?P<weeks>[\.\d]+?)w)?((?P<days>[\.\d]+?)d)?')
+def parse_duration(duration_str):
+    parts = duration_regex.match(duration_str)
+    if not parts:
+        return
+    parts = parts.groupdict()
+    time_params = {}
+    for name, param in parts.items():
+        if param:
+            time_params[name] = int(param)
+    return timedelta(**time_params)
+
+def report_end(args):
+    # Only one of --date-end or --duration is used; --duration takes precedence
+    if args.duration != None:
+        time_delta = parse_duration(args.duration)
+        date_begin_obj = datetime.strptime(args.date_begin,'%Y%m%d')
+        date_end_obj = date_begin_obj + time_delta
+        return date_end_obj.strftime('%Y%m%d')
+    return args.date_end
+
+#
+# One-time bootstrap
+#
+# The stamp file records the workon version that last populated the context
+# directory. While it matches, the bootstrap is skipped entirely.
+#
+def bootstrap_done(session):
+    try:
+        with open(session.bootstrap_file) as fp:
+            return fp.read().strip() == workon.__version__
+    except:
+        return False
+
+def bootstrap(session):
+    import shutil
+
+    try:
+        # Create context directory
+        os.mkdir(session.context_dir)
+    except:
+        pass
+
+    try:
+        # Create function directory
+        src_dir = os.path.join(get_script_path(), 'function_dir')
+        shutil.copytree(src_dir, session.function_dir)
+    except:
+        pass
+    
+    try:
+        # Create template directory
+        src_dir = os.path.join(get_script_path(), 'template_dir')
+        shutil.copytree(src_dir, session.template_dir)
+    except:
+        pass
+    
+    try:
+        # Create time tracking database
+        tracking.create_time_spent_db(session)
+    except:
+        pass
+
+    try:
+        with open(session.bootstrap_file, 'w') as fp:
+            fp.write(workon.__version__)
+    except Exception as e:
+        print('Error writing bootstrap stamp: {}'.format(e))
+
+#
+# Command line
+#
+def build_parser():
+    parser = argparse.ArgumentParser(description='Establish/switch project contexts.')
+    
+    listing_group = parser.add_argument_group('List available contexts/pre-defined functions')
+    listing_group.add_argument('-l', '--list', dest='list', action='store_true', default=False,
+                        help='List the available contexts')
+    listing_group.add_argument('-v', '--verbose', dest='verbose', action='store_true', default=False,
+                        help='Verbose output for listing (shows pre-defined functions)')
+    listing_group.add_argument('--completion', dest='completion', choices=completion.SHELLS,
+                        help='Print the completion script for the given shell')
+    listing_group.add_argument('--rebuild-catalog', dest='rebuild_catalog', action='store_true', default=False,
+                        help='Rebuild the context catalog from the context directory')
+    
+    modify_group = parser.add_argument_group('Change/show running context')
+    modify_group.add_argument('-c', '--close', dest='close', action='store_true', default=False,
+                        help='Close a running context')
+    modify_group.add_argument('-a', '--add', dest='addtocontext', action='store_true', default=False,
+                        help='Add to the current running context')
+    modify_group.add_argument('-s', '--show', dest='show', action='store_true', default=False,
+                        help='Show the current running context')
+    modify_group.add_argument('--hibernate', dest='hibernate', action='store_true', default=False,
+                        help='Suspend running contexts instead of closing them')
+    
+    edit_group = parser.add_argument_group('Edit context definition')
+    edit_group.add_argument('-n', '--new', dest='create', action='store_true', default=False,
+                        help='Create a new context')
+    edit_group.add_argument('--clone', dest='clone', metavar='SOURCE',
+                        help='Create a new context as a copy of a context or template')
+    edit_group.add_argument('-e', '--edit', dest='edit', action='store_true', default=False,
+                        help='Edit a context definition')
+    edit_group.add_argument('-f', '--function', dest='function', 
+                        help='Add pre-defined functions (comma-separated) to the contexts given by name, comma-separated list or pattern')
+    
+    archive_group = parser.add_argument_group('Archive')
+    archive_group.add_argument('--archive', dest='archive', action='store_true', default=False,
+                        help='Archive a context (or contexts matching a pattern). Can be restored later.')
+    archive_group.add_argument('--restore', dest='restore', action='store_true', default=False,
+                        help='Restore a context (or contexts matching a pattern) from the archive.')
+    archive_group.add_argument('--list-archive', dest='list_archive', action='store_true', default=False,
+                        help='List the contexts in the archive (with -v, their sizes).')
+    
+    snapshot_group = parser.add_argument_group('Snapshots')
+    snapshot_group.add_argument('--snapshot', dest='snapshot', action='store_true', default=False,
+                        help='Take a snapshot of a context definition and its files.')
+    snapshot_group.add_argument('--list-snapshots', dest='list_snapshots', action='store_true', default=False,
+                        help='List the snapshots of a context (or of all contexts).')
+    snapshot_group.add_argument('--restore-snapshot', dest='restore_snapshot', type=int,
+                        help='Restore a context from the snapshot with the given ID.')
+    snapshot_group.add_argument('--gc', dest='gc', action='store_true', default=False,
+                        help='Delete snapshot data that is no longer used.')
+    
+    time_group = parser.add_argument_group('Time Tracking')
+    time_group.add_argument('--time-spent', dest='time_spent', action='store_true', default=False,
+                        help='Display the amount of time spent in a context.')
+    time_group.add_argument('--usage', dest='usage', action='store_true', default=False,
+                        help='Display the CPU, memory and I/O used by each context (sampled by the daemon).')
+    time_group.add_argument('--date-begin', dest='date_begin', 
+                        type=str, default=date.today().strftime('%Y%m%d'),
+                        help='Beginning date for time spent. Format: YYYYMMDD')
+    time_group.add_argument('--date-end', dest='date_end', 
+                        type=str, default=date.today().strftime('%Y%m%d'),
+                        help='End date for time spent. Format: YYYYMMDD')
+    time_group.add_argument('--duration', dest='duration', 
+                        type=str, nargs='?',
+                        help='Duration time spent. Only one of --date-end or --duration are used. --duration takes precedence. Format: <number>[weeks|days]')
+    time_group.add_argument('--group-by', dest='group_by', choices=report.GROUPINGS, default='context',
+                        help='Break time spent down by context, day, week or month')
+    time_group.add_argument('--top', dest='top', type=int,
+                        help='Limit time spent to the N contexts with the most time, or the context list to the N highest ranked')
+    time_group.add_argument('--format', dest='output_format', choices=report.FORMATS, default='table',
+                        help='Output format for time spent')
+    time_group.add_argument('--add-time', dest='additional_time',
+                        type=str, default='',
+                        help='Elapsed time to add. Format: HH:MM:SS')
+    time_group.add_argument('--running-at', dest='running_at', type=str,
+                        help='Show the contexts that were running at a point in time. Format: YYYYMMDD-HH:MM:SS')
+    time_group.add_argument('--verify-rollups', dest='verify_rollups', action='store_true', default=False,
+                        help='Recompute the time spent rollups and report mismatches')
+    time_group.add_argument('--rebuild-rollups', dest='rebuild_rollups', action='store_true', default=False,
+                        help='Recompute the time spent rollups from the daily records')
+    
+    daemon_group = parser.add_argument_group('Daemon')
+    daemon_group.add_argument('--daemon', dest='daemon', action='store_true', default=False,
+                        help='Run the workon daemon, which serves later invocations over a unix socket')
+    
+    parser.add_argument('context', nargs='?', default='', help='Name of the context to create/open/close')
+
+    return parser
+
+def operation(args):
+    if args.daemon == True:
+        return 'daemon'
+    elif args.list == True:
+        return 'list'
+    elif args.completion != None:
+        return 'completion'
+    elif args.rebuild_catalog == True:
+        return 'rebuild_catalog'
+    elif args.list_archive == True:
+        return 'list_archive'
+    elif args.archive == True:
+        return 'archive'
+    elif args.restore == True:
+        return 'restore'
+    elif args.snapshot == True:
+        return 'snapshot'
+    elif args.list_snapshots == True:
+        return 'list_snapshots'
+    elif args.restore_snapshot != None:
+        return 'restore_snapshot'
+    elif args.gc == True:
+        return 'gc'
+    elif args.show == True:
+        return 'show'
+    elif args.edit == True:
+        return 'edit'
+    elif args.create == True:
+        return 'create'
+    elif args.clone != None:
+        return 'clone'
+    elif args.function != None:
+        return 'function'
+    elif args.time_spent == True:
+        return 'time_spent'
+    elif args.usage == True:
+        return 'usage'
+    elif args.running_at != None:
+        return 'running_at'
+    elif args.verify_rollups == True:
+        return 'verify_rollups'
+    elif args.rebuild_rollups == True:
+        return 'rebuild_rollups'
+    elif len(args.additional_time) > 0:
+        return 'add_time'
+    elif args.close == True:
+        return 'close'
+    elif len(args.context) == 0:
+        return 'help'
+    else:
+        return 'switch'
+
+#
+# Context name lookup
+#
+# Commands that take an existing context also accept a unique prefix or a
+# unique part of its name. A name that matches nothing is left as given.
+#
+RESOLVED_OPS={'switch': False, 'edit': False, 'function': False, 'archive': False, 'close': False, 'restore': True,
+              'snapshot': False, 'list_snapshots': False}
+
+def resolve_context(args, op, session):
+    if op not in RESOLVED_OPS or len(args.context) == 0:
+        return True
+    if op in ('archive', 'restore', 'function') and any(c in args.context for c in '*?['):
+        # A pattern selecting several contexts
+        return True
+    if op == 'function' and ',' in args.context:
+        # A list of contexts
+        return True
+
+    matches = catalog.resolve(args.context, session, RESOLVED_OPS[op])
+    if len(matches) == 1:
+        args.context = matches[0]
+    elif len(matches) > 1:
+        print('Ambiguous context name {}: {}'.format(args.context, ', '.join(matches)))
+        return False
+    return True
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    #
+    # Create directories if they do not exist
+    #
+    session = config.get_session()
+    if bootstrap_done(session) == False:
+        bootstrap(session)
+
+    run(args, parser, session)
+
+def run(args, parser, session):
+    #
+    # Execute User Instruction
+    #
+    op = operation(args)
+    if resolve_context(args, op, session) == False:
+        return
+
+    if op == 'daemon':
+        from workon import daemon
+        daemon.serve()
+
+    elif op == 'list':
+        #
+        # List available contexts
+        #
+        # The catalog returns contexts ranked by frecency
+        for name,last_access in catalog.list_contexts(session, top=args.top):
+            if args.verbose and last_access > 0:
+                datecode = datetime.fromtimestamp(last_access)
+                datestr = datecode.strftime("%d/%m/%Y %H:%M:%S")
+                print('{:.<16} (Last access: {})'.format(name, datestr))
+            else:
+                print('{}'.format(name))
+    
+        if args.verbose:
+            print('=== Available Functions ===')
+            function_list = function.get_functions(session)
+            for func in function_list:
+                print('{}'.format(func))
+    
+    elif op == 'completion':
+        sys.stdout.write(completion.script(args.completion, parser, session))
+
+    elif op == 'rebuild_catalog':
+        catalog.reconcile(session, full=True)
+
+    elif op == 'list_archive':
+        #
+        # List available contexts
+        #
+        archive_list = archive.get_archive(session)
+        manifest = archive.read_manifest(session) if args.verbose else {}
+    
+        # Display list
+        for arc in archive_list:
+            if arc in manifest:
+                archived_at,size,packed_size,files,checksum = manifest[arc]
+                datestr = datetime.fromtimestamp(archived_at).strftime("%d/%m/%Y %H:%M:%S")
+                print('{:.<16} (Archived: {}, {} files, {:.1f} MiB packed to {:.1f} MiB)'.format(
+                    arc, datestr, files, size / 1048576, packed_size / 1048576))
+            else:
+                print('{}'.format(arc))
+    
+    
+    elif op == 'archive':
+        archive.move_to_archive(args.context, session)
+    
+    elif op == 'restore':
+        archive.restore_from_archive(args.context, session)
+    
+    elif op == 'snapshot':
+        if len(args.context) == 0:
+            parser.print_help()
+        else:
+            snapshot.take_snapshot(args.context, session)
+
+    elif op == 'list_snapshots':
+        for snapshot_id,ctx,created,files,size,new_bytes in snapshot.list_snapshots(args.context, session):
+            datestr = datetime.fromtimestamp(created).strftime("%d/%m/%Y %H:%M:%S")
+            print('{:>5} {:.<16} {} {:6} entries {:10.1f} MiB ({:.1f} MiB new)'.format(
+                snapshot_id, ctx, datestr, files, size / 1048576, new_bytes / 1048576))
+
+    elif op == 'restore_snapshot':
+        snapshot.restore_snapshot(args.restore_snapshot, session)
+
+    elif op == 'gc':
+        snapshot.gc(session)
+
+    elif op == 'show':
+        current_context = context.read_current_context(session)
+        print(json.dumps(current_context, indent=2))
+    
+    elif op == 'edit':
+        cfgfile = session.context_file(args.context)
+        editor = launcher.find_command(os.environ['EDITOR'])
+        if len(editor) > 0:
+            spawnargs = tuple([editor] + [cfgfile])
+            os.spawnv(os.P_NOWAIT, editor, spawnargs)
+        else:
+            print("Cannot find editor: {}".format(os.environ['EDITOR']))
+    
+    elif op == 'create':
+        #
+        # Create new context
+        #
+        if len(args.context) == 0:
+            parser.print_help()
+        else:
+            # Context context file
+            ctxfile = session.context_file(args.context)
+            context.write_context(ctxfile, dict())
+            # Create directory for context
+            ctxfiles = session.support_dir(args.context)
+            os.mkdir(ctxfiles)
+            catalog.add_context(args.context, session)
+    
+    elif op == 'clone':
+        if len(args.context) == 0:
+            parser.print_help()
+        else:
+            clone.clone_context(args.clone, args.context, session)
+    
+    elif op == 'function':
+        #
+        # Create new context
+        #
+        if len(args.context) == 0:
+            parser.print_help()
+        else:
+            funcs = [func.strip() for func in args.function.split(',') if len(func.strip()) > 0]
+            contexts = catalog.select_contexts([ctx.strip() for ctx in args.context.split(',')], session=session)
+            function.apply_functions(funcs, contexts, session)
+    
+    elif op == 'time_spent':
+        date_end = report_end(args)
+        rows = report.time_spent_report(args.date_begin, date_end, args.group_by, args.top, session)
+        print(report.format_report(rows, args.date_begin, date_end, args.group_by, args.output_format))
+    
+    elif op == 'usage':
+        date_end = report_end(args)
+        rows = report.usage_report(args.date_begin, date_end, args.top, session)
+        print(report.format_usage(rows, args.date_begin, date_end, args.output_format))
+    
+    elif op == 'running_at':
+        timestamp = datetime.strptime(args.running_at, '%Y%m%d-%H:%M:%S').timestamp()
+        for ctx in tracking.running_at(timestamp, session):
+            print('{}'.format(ctx))
+
+    elif op == 'verify_rollups':
+        mismatches = rollup.verify(tracking.connect(session))
+        for span,bucket,ctx,expected,actual in mismatches:
+            print('{:<6} {:<10} {:.<16} expected {:.3f}, found {:.3f}'.format(span, bucket, ctx, expected, actual))
+        print('{} rollup mismatch(es)'.format(len(mismatches)))
+
+    elif op == 'rebuild_rollups':
+        rollup.rebuild(tracking.connect(session))
+
+    elif op == 'add_time':
+        t0 = datetime.strptime('0','%S')
+        t1 = datetime.strptime(args.additional_time, '%H:%M:%S')
+        elapsed = (t1-t0).total_seconds()
+        print('Adding {} seconds to {} context'.format(elapsed, args.context))
+        tracking.add_time_spent(args.context, elapsed, session)
+    
+    elif op == 'close':
+        if args.hibernate == True:
+            current_context = context.hibernate_context(args.context, session)
+        else:
+            current_context = context.close_context(args.context, session, args.verbose)
+            context.close_hibernated(args.context, session)
+
+        # The most recently used of the remaining contexts moves to the foreground
+        if len(current_context) > 0:
+            priority.apply_priorities(current_context, priority.most_recent(current_context, session), session)
+    
+    elif op == 'help':
+        parser.print_help()
+
+    else:
+        #
+        # End previous context (unless 'addtocontext' requested)
+        #
+        if args.addtocontext == False:
+            if args.hibernate == True or context.hibernate_enabled(session):
+                context.hibernate_context(session=session)
+            else:
+                context.close_context(session=session, verbose=args.verbose)
+    
+        #
+        # Start new context
+        #
+        app = context.resume_context(args.context, session)
+        plan = launcher.get_plan(args.context, session)
+        if app == None:
+            app = launcher.launch_plan(plan)
+        elif len(plan['apps'].keys() - app.keys()) > 0:
+            # Applications that exited while the context was hibernated
+            app.update(launcher.launch_plan(plan, running=app))
+    
+        #
+        # Save current context info
+        #
+        # One transaction covers the running state, the timer, the history
+        # and the catalog. The state is re-read inside it; other invocations
+        # may have changed it while the applications were starting.
+        #
+        access_time = time.time()
+        with storage.transaction(session):
+            current_context = context.read_current_context(session)
+            current_context[args.context] = app
+            context.write_current_context(current_context, session)
+            tracking.start_timer(args.context, session)
+            history.record_access(args.context, access_time, session)
+            catalog.touch_context(args.context, access_time, session)
+
+        # Outside the transaction, so the switch does not hold the write
+        # lock while the completion index is compared and rewritten
+        completion.refresh(session)
+
+        priority.apply_priorities(current_context, args.context, session)
+
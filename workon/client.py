@@ -0,0 +1,69 @@
+import os
+import sys
+import json
+import socket
+
+SOCKET_NAME='workon-{}.sock'
+
+#
+# Thin client
+#
+# Invocations are forwarded to a running workon daemon when there is one.
+# This module is imported on every invocation, so it sticks to the few
+# standard modules it needs; the rest of workon is only imported when the
+# command runs in direct mode.
+#
+def socket_path():
+    path = os.environ.get('WORKON_SOCKET')
+    if path:
+        return path
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or '/tmp'
+    return os.path.join(runtime_dir, SOCKET_NAME.format(os.getuid()))
+
+def request(argv, path=None):
+    if path == None:
+        path = socket_path()
+
+    try:
+        # Never hand the environment to a socket another user created
+        if os.stat(path).st_uid != os.getuid():
+            return None
+    except OSError:
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        message = {'argv': argv, 'cwd': os.getcwd(), 'env': dict(os.environ)}
+        sock.sendall(json.dumps(message).encode() + b'\n')
+        sock.shutdown(socket.SHUT_WR)
+
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        reply = json.loads(b''.join(chunks))
+    except (OSError, ValueError):
+        return None
+    finally:
+        sock.close()
+
+    if reply.get('fallback') == True:
+        return None
+    return reply
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if '--daemon' not in argv:
+        reply = request(argv)
+        if reply != None:
+            sys.stdout.write(reply['stdout'])
+            sys.stderr.write(reply['stderr'])
+            return reply['status']
+
+    from workon import cli
+    return cli.main(argv)
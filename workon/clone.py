@@ -0,0 +1,201 @@
+import os
+import stat
+import errno
+from workon import config,context,catalog,state
+
+FICLONE=0x40049409
+COPY_CHUNK=64 * 1024 * 1024
+
+#
+# File copies
+#
+# A copy is first attempted as a reflink (FICLONE), which shares the data
+# blocks on btrfs, XFS and other copy-on-write filesystems and takes the
+# same time whatever the file size. Elsewhere the kernel copies the data
+# with copy_file_range (which NFS and some filesystems also offload) or,
+# failing that, sendfile; the data never passes through Python.
+#
+FALLBACK_ERRORS=(errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EPERM, errno.EBADF)
+
+def kernel_copy(src_fd, dst_fd, size):
+    import fcntl
+
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return 'reflink'
+    except OSError as e:
+        if e.errno not in FALLBACK_ERRORS:
+            raise
+
+    for method in ('copy_file_range', 'sendfile'):
+        offset = 0
+        try:
+            while offset < size:
+                if method == 'copy_file_range':
+                    copied = os.copy_file_range(src_fd, dst_fd, min(COPY_CHUNK, size - offset), offset, offset)
+                else:
+                    copied = os.sendfile(dst_fd, src_fd, offset, min(COPY_CHUNK, size - offset))
+                if copied == 0:
+                    break
+                offset = offset + copied
+            return method
+        except (OSError, AttributeError) as e:
+            # Only fall back before anything was copied
+            if offset > 0 or (isinstance(e, OSError) and e.errno not in FALLBACK_ERRORS):
+                raise
+    return None
+
+def copy_file(src, dst, st=None):
+    import shutil
+
+    if st is None:
+        st = os.stat(src)
+
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, stat.S_IMODE(st.st_mode))
+        try:
+            if kernel_copy(src_fd, dst_fd, st.st_size) == None:
+                with os.fdopen(os.dup(src_fd), 'rb') as fsrc, os.fdopen(os.dup(dst_fd), 'wb') as fdst:
+                    shutil.copyfileobj(fsrc, fdst)
+            os.fchmod(dst_fd, stat.S_IMODE(st.st_mode))
+            os.utime(dst_fd, ns=(st.st_atime_ns, st.st_mtime_ns))
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+
+#
+# Tree copies
+#
+# Directories are scanned on a thread pool and every file is copied as a
+# separate task, so a deep tree is traversed and copied concurrently.
+# Directory times are set once everything below them has been copied.
+#
+def worker_count(session):
+    return max(1, int(session.cfg.get('clone_threads', min(32, (os.cpu_count() or 1) * 4))))
+
+def rename_entry(name, renames):
+    for old,new in renames.items():
+        name = name.replace(old, new)
+    return name
+
+def scan_directory(src, dst, renames):
+    subdirs = []
+    files = []
+    for entry in os.scandir(src):
+        target = os.path.join(dst, rename_entry(entry.name, renames))
+        st = entry.stat(follow_symlinks=False)
+        if entry.is_symlink():
+            os.symlink(os.readlink(entry.path), target)
+        elif entry.is_dir(follow_symlinks=False):
+            os.mkdir(target, stat.S_IMODE(st.st_mode) | stat.S_IRWXU)
+            subdirs.append((entry.path, target, st))
+        elif entry.is_file(follow_symlinks=False):
+            files.append((entry.path, target, st))
+    return subdirs,files
+
+def copy_tree(src, dst, renames, session):
+    import concurrent.futures
+
+    st = os.stat(src)
+    os.mkdir(dst, stat.S_IMODE(st.st_mode) | stat.S_IRWXU)
+    directories = [(dst, st)]
+
+    with concurrent.futures.ThreadPoolExecutor(worker_count(session)) as pool:
+        pending = {pool.submit(scan_directory, src, dst, renames)}
+        while len(pending) > 0:
+            done,pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if result == None:
+                    continue
+                subdirs,files = result
+                for subsrc,subdst,subst in subdirs:
+                    directories.append((subdst, subst))
+                    pending.add(pool.submit(scan_directory, subsrc, subdst, renames))
+                for filesrc,filedst,filest in files:
+                    pending.add(pool.submit(copy_file, filesrc, filedst, filest))
+
+    # Deepest directories first
+    directories.sort(key=lambda entry: entry[0].count(os.sep), reverse=True)
+    for path,st in directories:
+        os.chmod(path, stat.S_IMODE(st.st_mode))
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+#
+# Cloning contexts and instantiating templates
+#
+# The source is a live context or, failing that, a template in the
+# template directory (<template>.json plus an optional <template>.files
+# directory). "<name>" and "<context_dir>" in the definition, and "<name>"
+# in file names, are replaced as in functions. Cloning a live context also
+# points paths into its support directory at the new one.
+#
+def substitute(value, replacements):
+    if isinstance(value, str):
+        for old,new in replacements:
+            value = value.replace(old, new)
+        return value
+    if isinstance(value, dict):
+        return {substitute(k, replacements): substitute(v, replacements) for k,v in value.items()}
+    if isinstance(value, list):
+        return [substitute(v, replacements) for v in value]
+    return value
+
+def find_source(source, session):
+    if os.path.exists(session.context_file(source)) == False:
+        template = os.path.join(session.template_dir, source)
+        if os.path.exists(template + '.json'):
+            return (template + '.json', template + '.files', True)
+
+        matches = catalog.resolve(source, session)
+        if len(matches) > 1:
+            print('Ambiguous context name {}: {}'.format(source, ', '.join(matches)))
+        if len(matches) != 1:
+            return None
+        source = matches[0]
+
+    return (session.context_file(source), session.support_dir(source), False)
+
+def clone_context(source, context_name, session=None):
+    import shutil
+    import tempfile
+
+    if session is None:
+        session = config.get_session()
+
+    if os.path.exists(session.context_file(context_name)) or os.path.exists(session.support_dir(context_name)):
+        print('Error cloning context: {} (already exists)'.format(context_name))
+        return
+
+    found = find_source(source, session)
+    if found == None:
+        print('Error cloning context: {} (no single context or template of that name)'.format(source))
+        return
+    src_file,src_dir,is_template = found
+
+    replacements = []
+    if is_template == False:
+        replacements.append((src_dir, session.support_dir(context_name)))
+    replacements.append(('<name>', context_name))
+    replacements.append(('<context_dir>', session.context_dir))
+    definition = substitute(state.load(src_file), replacements)
+
+    # The files are copied to a staging directory and renamed into place
+    support_dir = session.support_dir(context_name)
+    staging = tempfile.mkdtemp(prefix='.clone-{}.'.format(context_name), dir=session.context_dir)
+    try:
+        if os.path.isdir(src_dir):
+            copy_tree(src_dir, os.path.join(staging, 'files'), {'<name>': context_name}, session)
+            os.rename(os.path.join(staging, 'files'), support_dir)
+        else:
+            os.mkdir(support_dir)
+    except Exception as e:
+        print('Error cloning context: {} ({})'.format(context_name, e))
+        return
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    context.write_context(session.context_file(context_name), definition)
+    catalog.add_context(context_name, session)
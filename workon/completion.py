@@ -0,0 +1,103 @@
+import shlex
+from workon import config,state
+
+SHELLS=('bash', 'zsh')
+
+#
+# Shell completion
+#
+# Completing a context name must not start Python, so the catalog writes
+# the ranked names of the live and the archived contexts, one per line, to
+# session.completion_file and session.archive_completion_file whenever it
+# changes. The scripts printed by "workon --completion <shell>" read those
+# files directly. Names keep the catalog's frecency order; the scripts ask
+# the shell not to sort them. A file is only rewritten when its contents
+# change, so switching contexts usually leaves both untouched.
+#
+def read_index(filename):
+    try:
+        with open(filename) as fp:
+            return fp.read()
+    except FileNotFoundError:
+        return None
+
+def refresh(session=None):
+    from workon import catalog
+
+    if session is None:
+        session = config.get_session()
+
+    try:
+        connection = catalog.connect(session)
+        for archived,filename in ((False, session.completion_file), (True, session.archive_completion_file)):
+            names = [name for name,last_access in catalog.ranked(connection, archived, session=session)]
+            text = ''.join(name + '\n' for name in names)
+            if read_index(filename) != text:
+                state.write_atomic(filename, text, sync=False)
+    except Exception as e:
+        print('Error writing completion index: {}'.format(e))
+
+def option_strings(parser):
+    options = []
+    for action in parser._actions:
+        options.extend(action.option_strings)
+    return sorted(options)
+
+BASH_SCRIPT='''\
+_workon_complete_()
+{{
+    local word="${{COMP_WORDS[COMP_CWORD]}}"
+    local names={live}
+    local w
+
+    if [[ "$word" == -* ]]; then
+        COMPREPLY=($(compgen -W "{options}" -- "$word"))
+        return
+    fi
+    for w in "${{COMP_WORDS[@]}}"; do
+        if [[ "$w" == --restore ]]; then
+            names={archived}
+        fi
+    done
+    if [[ -r "$names" ]]; then
+        COMPREPLY=($(compgen -W "$(< "$names")" -- "$word"))
+    fi
+}}
+complete -o nosort -F _workon_complete_ workon 2>/dev/null || complete -F _workon_complete_ workon
+'''
+
+ZSH_SCRIPT='''\
+_workon() {{
+    local names={live}
+
+    if [[ $PREFIX == -* ]]; then
+        compadd -- {options}
+        return
+    fi
+    if (( ${{words[(I)--restore]}} )); then
+        names={archived}
+    fi
+    if [[ -r $names ]]; then
+        compadd -V contexts -- ${{(f)"$(<$names)"}}
+    fi
+}}
+compdef _workon workon
+'''
+
+def script(shell, parser, session=None):
+    import os
+
+    if session is None:
+        session = config.get_session()
+
+    if os.path.exists(session.completion_file) == False:
+        refresh(session)
+
+    if shell == 'zsh':
+        template = ZSH_SCRIPT
+    else:
+        template = BASH_SCRIPT
+
+    return template.format(live=shlex.quote(session.completion_file),
+                           archived=shlex.quote(session.archive_completion_file),
+                           options=' '.join(option_strings(parser)))
@@ -3,6 +3,22 @@ import json
 
 CONFIG_FILE='.workon.cfg'
 
+CURRENT_CONTEXT_FILE='.current_context.json'
+HISTORY_FILE='.history.json'
+TIME_TRACK_DB='.time_track.db'
+TIMERS_FILE='.timers.json'
+HIBERNATE_FILE='.hibernated.json'
+ARCHIVE_DIR='archive'
+ARCHIVE_BUNDLE_EXT='.tar.xz'
+FUNCTION_DIR='function_dir'
+TEMPLATE_DIR='template_dir'
+BOOTSTRAP_FILE='.bootstrap'
+PLAN_DIR='.plans'
+STATE_LOCK_FILE='.state.lock'
+COMPLETION_FILE='.completions'
+ARCHIVE_COMPLETION_FILE='.completions-archived'
+BLOB_DIR='.blobs'
+
 #
 # Workon configuration
 #
@@ -13,8 +29,11 @@ def default_config():
     }
     return config
 
+def config_path():
+    return os.path.join(os.environ['HOME'], CONFIG_FILE)
+
 def read_config():
-    config_file = os.path.join(os.environ['HOME'], CONFIG_FILE)
+    config_file = config_path()
     config = {}
 
     try:
@@ -28,7 +47,7 @@ def read_config():
     return config
 
 def write_config(config):
-    config_file = os.path.join(os.environ['HOME'], CONFIG_FILE)
+    config_file = config_path()
 
     try:
         with open(config_file, 'w') as fp:
@@ -37,4 +56,72 @@ def write_config(config):
     except Exception as e:
         print(e)
 
+#
+# Runtime session
+#
+# The session holds the configuration and every path derived from it, so a
+# single invocation parses ~/.workon.cfg once. The cached session is reused
+# until the configuration file's mtime changes.
+#
+class Session:
+    def __init__(self, cfg, stamp=None):
+        self.cfg = cfg
+        self.stamp = stamp
+
+        self.context_dir = cfg['context_dir']
+        self.time_track_db = os.path.join(self.context_dir, TIME_TRACK_DB)
+        self.archive_dir = os.path.join(self.context_dir, ARCHIVE_DIR)
+        self.function_dir = os.path.join(self.context_dir, FUNCTION_DIR)
+        self.template_dir = os.path.join(self.context_dir, TEMPLATE_DIR)
+        self.bootstrap_file = os.path.join(self.context_dir, BOOTSTRAP_FILE)
+        self.plan_dir = os.path.join(self.context_dir, PLAN_DIR)
+        self.state_lock_file = os.path.join(self.context_dir, STATE_LOCK_FILE)
+        self.completion_file = os.path.join(self.context_dir, COMPLETION_FILE)
+        self.archive_completion_file = os.path.join(self.context_dir, ARCHIVE_COMPLETION_FILE)
+        self.blob_dir = os.path.join(self.context_dir, BLOB_DIR)
+
+    def context_file(self, context_name):
+        return os.path.join(self.context_dir, context_name + '.json')
+
+    def support_dir(self, context_name):
+        return os.path.join(self.context_dir, context_name + '.files')
+
+    def archive_file(self, context_name):
+        return os.path.join(self.archive_dir, context_name + '.json')
+
+    def archive_support_dir(self, context_name):
+        return os.path.join(self.archive_dir, context_name + '.files')
+
+    def archive_bundle(self, context_name):
+        return os.path.join(self.archive_dir, context_name + ARCHIVE_BUNDLE_EXT)
+
+    def plan_file(self, context_name):
+        return os.path.join(self.plan_dir, context_name + '.json')
+
+    def function_file(self, func):
+        return os.path.join(self.function_dir, '{}.func'.format(func))
+
+_session = None
+
+def config_stamp():
+    config_file = config_path()
+    try:
+        st = os.stat(config_file)
+        return (config_file, st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+def get_session():
+    global _session
+
+    stamp = config_stamp()
+    if _session is None or stamp is None or stamp != _session.stamp:
+        cfg = read_config()
+        _session = Session(cfg, config_stamp())
+
+    return _session
+
+def reset_session():
+    global _session
+    _session = None
 
@@ -1,79 +1,268 @@
-import os
-import json
+import time
 import signal
 from workon import config
+from workon import catalog
 from workon import tracking
-
-CURRENT_CONTEXT_FILE='.current_context.json'
+from workon import process
+from workon import shutdown
+from workon import state
+from workon import storage
 
 #
 # Context storage
 #
-def get_contexts():
-    context_list = []
+def get_contexts(session=None):
+    if session is None:
+        session = config.get_session()
 
-    cfg = config.read_config()
-    for f in os.listdir(cfg['context_dir']):
-        if f[0] != '.' and os.path.splitext(f)[1] == '.json':
-            context_list.append(os.path.splitext(f)[0])
+    context_list = []
+    for name,last_access in catalog.list_contexts(session):
+        context_list.append(name)
 
     return context_list
 
-def read_context(context_name):
-    cfg = config.read_config()
-    ctxfile = os.path.join(cfg['context_dir'], context_name + '.json')
-    with open(ctxfile) as fp:
-        context = json.load(fp)
+def read_context(context_name, session=None):
+    if session is None:
+        session = config.get_session()
 
-    return context
+    return state.load(session.context_file(context_name))
 
 def write_context(filename, context):
-    with open(filename, 'w') as fp:
-        json.dump(context, fp, indent=2)
+    state.store(filename, context, indent=2)
         
-def read_current_context():
-    cfg = config.read_config()
-    ctxfile = os.path.join(cfg['context_dir'], CURRENT_CONTEXT_FILE)
-    with open(ctxfile) as fp:
-        current_context = json.load(fp)
+#
+# Running state
+#
+# The running contexts, their applications and the hibernated contexts are
+# kept in the time tracking database. Applications are stored as
+# [pid, launch time, process start time] in definition order.
+#
+def read_apps(connection, hibernated):
+    apps = {}
+    for ctx,app,pid,launched,start_time in connection.execute(
+            'SELECT context, app, pid, launched, start_time FROM context_apps WHERE hibernated=? ORDER BY rowid',
+            (hibernated,)):
+        apps.setdefault(ctx, {})[app] = [pid, launched, start_time]
+    return apps
+
+def write_apps(connection, ctx, apps, hibernated):
+    rows = []
+    for app,info in apps.items():
+        info = list(info) + [None, None]
+        rows.append((ctx, app, hibernated, info[0], info[1], info[2]))
+    connection.executemany('INSERT OR REPLACE INTO context_apps(context, app, hibernated, pid, launched, start_time) '
+                           'VALUES(?, ?, ?, ?, ?, ?)', rows)
+
+def read_current_context(session=None):
+    connection = storage.get_connection(session)
+
+    current_context = {}
+    for (ctx,) in connection.execute('SELECT context FROM current_context ORDER BY rowid'):
+        current_context[ctx] = {}
+    for ctx,apps in read_apps(connection, 0).items():
+        if ctx in current_context:
+            current_context[ctx] = apps
 
     return current_context
         
-def write_current_context(current_context):
-    cfg = config.read_config()
-    ctxfile = os.path.join(cfg['context_dir'], CURRENT_CONTEXT_FILE)
-    write_context(ctxfile, current_context)
+def write_current_context(current_context, session=None):
+    with storage.transaction(session) as connection:
+        connection.execute('DELETE FROM current_context')
+        connection.execute('DELETE FROM context_apps WHERE hibernated=0')
+        for ctx,apps in current_context.items():
+            connection.execute('INSERT INTO current_context(context) VALUES(?)', (ctx,))
+            write_apps(connection, ctx, apps, 0)
+
+def close_context(context='', session=None, verbose=False):
+    if session is None:
+        session = config.get_session()
 
-def close_context(context=''):
     current_context = {}
-    try:
-        current_context = read_current_context()
+    closing = {}
+    with storage.transaction(session):
+        try:
+            current_context = read_current_context(session)
 
-        for ctx,apps in current_context.items():
-            if len(context) == 0 or ctx == context:
-                tracking.stop_timer(ctx)
+            for ctx,apps in list(current_context.items()):
+                if len(context) == 0 or ctx == context:
+                    tracking.stop_timer(ctx, session)
 
-                for app,info in apps.items():
-                    pid = info[0]
-                    try:
-                        os.kill(pid, signal.SIGTERM)
-                    except Exception as e:
-                        print('Error killing {} ({})'.format(app, e))
+                    for app,info in apps.items():
+                        closing[(ctx, app)] = info
 
-                if len(context) > 0:
-                    del current_context[ctx]
+                    if len(context) > 0:
+                        del current_context[ctx]
 
-        if len(context) == 0:
-            current_context = {}
+            if len(context) == 0:
+                current_context = {}
+
+        except Exception as e:
+            print('Error closing contexts: {}'.format(e))
+
+        #
+        # Save current context info
+        #
+        write_current_context(current_context, session)
 
-    except Exception as e:
-        print('Error closing contexts: {}'.format(e))
-    
     #
-    # Save current context info
-    # 
-    write_current_context(current_context)
+    # Shut down the applications of every closed context together
+    #
+    results = shutdown.shutdown_apps(closing, session=session)
+    if verbose:
+        shutdown.print_results(results)
     
     return current_context
 
+#
+# Hibernation
+#
+# Hibernated contexts are stopped with SIGSTOP instead of being closed, and
+# switching back to them continues the stopped applications. They are kept
+# apart from the running contexts, together with the time they were
+# hibernated.
+#
+def hibernate_enabled(session=None):
+    if session is None:
+        session = config.get_session()
+    return session.cfg.get('hibernate', False) == True
+
+def read_hibernated(session=None):
+    connection = storage.get_connection(session)
+
+    hibernated = {}
+    for ctx,since in connection.execute('SELECT context, since FROM hibernated ORDER BY rowid'):
+        hibernated[ctx] = {'apps': {}, 'since': since}
+    for ctx,apps in read_apps(connection, 1).items():
+        if ctx in hibernated:
+            hibernated[ctx]['apps'] = apps
+
+    return hibernated
+
+def write_hibernated(hibernated, session=None):
+    with storage.transaction(session) as connection:
+        connection.execute('DELETE FROM hibernated')
+        connection.execute('DELETE FROM context_apps WHERE hibernated=1')
+        for ctx,entry in hibernated.items():
+            connection.execute('INSERT INTO hibernated(context, since) VALUES(?, ?)', (ctx, entry['since']))
+            write_apps(connection, ctx, entry['apps'], 1)
+
+def signal_apps(apps, sig):
+    for app,info in apps.items():
+        try:
+            if process.same_process(info):
+                process.signal_app(info[0], sig)
+        except Exception as e:
+            print('Error signalling {} ({})'.format(app, e))
+
+def terminate_apps(apps, session=None):
+    shutdown.shutdown_apps(apps, session=session, stopped=True)
+
+def hibernate_context(context='', session=None):
+    if session is None:
+        session = config.get_session()
+
+    current_context = {}
+    evicted = []
+    with storage.transaction(session):
+        try:
+            current_context = read_current_context(session)
+            hibernated = read_hibernated(session)
+
+            for ctx,apps in list(current_context.items()):
+                if len(context) == 0 or ctx == context:
+                    tracking.stop_timer(ctx, session)
+                    signal_apps(apps, signal.SIGSTOP)
+                    hibernated[ctx] = {'apps': apps, 'since': time.time()}
+                    del current_context[ctx]
+
+            evicted = apply_hibernate_policy(hibernated, session)
+            write_hibernated(hibernated, session)
+        except Exception as e:
+            print('Error hibernating contexts: {}'.format(e))
+
+        write_current_context(current_context, session)
+
+    for apps in evicted:
+        terminate_apps(apps, session)
+
+    return current_context
+
+def resume_context(context, session=None):
+    if session is None:
+        session = config.get_session()
+
+    with storage.transaction(session):
+        hibernated = read_hibernated(session)
+        if context not in hibernated:
+            return None
+
+        apps = {}
+        for app,info in hibernated[context]['apps'].items():
+            if process.same_process(info):
+                apps[app] = info
+        del hibernated[context]
+        write_hibernated(hibernated, session)
+
+    if len(apps) == 0:
+        return None
+
+    signal_apps(apps, signal.SIGCONT)
+    return apps
+
+def close_hibernated(context='', session=None):
+    if session is None:
+        session = config.get_session()
+
+    closing = []
+    with storage.transaction(session):
+        hibernated = read_hibernated(session)
+        for ctx in list(hibernated):
+            if len(context) == 0 or ctx == context:
+                closing.append(hibernated[ctx]['apps'])
+                del hibernated[ctx]
+        write_hibernated(hibernated, session)
+
+    for apps in closing:
+        terminate_apps(apps, session)
+
+def apply_hibernate_policy(hibernated, session=None):
+    if session is None:
+        session = config.get_session()
+
+    # Evicted contexts are removed from hibernated and their applications
+    # returned, to be terminated once the state lock is released
+    evicted = []
+
+    # Oldest first
+    order = sorted(hibernated, key=lambda ctx: hibernated[ctx]['since'])
+
+    max_age = session.cfg.get('hibernate_max_age')
+    if max_age != None:
+        now = time.time()
+        for ctx in list(order):
+            if now - hibernated[ctx]['since'] > max_age:
+                evicted.append(hibernated[ctx]['apps'])
+                del hibernated[ctx]
+                order.remove(ctx)
+
+    max_count = session.cfg.get('hibernate_max_count')
+    if max_count != None:
+        while len(order) > max_count:
+            ctx = order.pop(0)
+            evicted.append(hibernated[ctx]['apps'])
+            del hibernated[ctx]
+
+    max_rss = session.cfg.get('hibernate_max_rss')
+    if max_rss != None:
+        rss = {}
+        for ctx in order:
+            rss[ctx] = 0
+            for app,info in hibernated[ctx]['apps'].items():
+                rss[ctx] = rss[ctx] + process.app_rss(info[0])
+        while len(order) > 0 and sum(rss.values()) > max_rss * 1024 * 1024:
+            ctx = order.pop(0)
+            evicted.append(hibernated[ctx]['apps'])
+            del hibernated[ctx]
+            del rss[ctx]
 
+    return evicted
@@ -0,0 +1,282 @@
+import os
+import io
+import json
+import time
+import heapq
+import itertools
+import signal
+import socket
+import selectors
+import contextlib
+from workon import client,launcher
+
+SERVED={'list', 'show', 'switch', 'close', 'time_spent', 'usage'}
+REQUEST_TIMEOUT=5.0
+MAX_REQUEST=1 << 20
+
+#
+# Workon daemon
+#
+# A long-running workon process serving CLI invocations on a unix socket.
+# The session, the tracking database connection and the parsed state files
+# stay loaded between requests, so a served invocation costs a socket round
+# trip instead of a Python start-up. Operations outside SERVED are answered
+# with a fallback and run by the client in direct mode.
+#
+# Requests are handled one at a time from a selector loop; other event
+# sources register callbacks on the same loop with watch() and schedule
+# work with call_later(). The loop sleeps until one of them is due.
+#
+class Daemon:
+    def __init__(self, path=None):
+        self.path = path if path != None else client.socket_path()
+        self.selector = selectors.DefaultSelector()
+        self.running = False
+        self.listener = None
+        self.timers = []
+        self.sequence = itertools.count()
+        self.sync_hooks = []
+        self.stop_hooks = []
+        self.child_owners = []
+
+    def watch(self, fileobj, callback, events=selectors.EVENT_READ):
+        self.selector.register(fileobj, events, callback)
+
+    def unwatch(self, fileobj):
+        self.selector.unregister(fileobj)
+
+    def call_later(self, delay, callback):
+        heapq.heappush(self.timers, (time.monotonic() + delay, next(self.sequence), callback))
+
+    def run_timers(self):
+        now = time.monotonic()
+        while len(self.timers) > 0 and self.timers[0][0] <= now:
+            deadline,seq,callback = heapq.heappop(self.timers)
+            try:
+                callback()
+            except Exception as e:
+                print('Error in scheduled task: {}'.format(e), flush=True)
+
+    def next_timeout(self):
+        if len(self.timers) == 0:
+            return None
+        return max(0.0, self.timers[0][0] - time.monotonic())
+
+    #
+    # Socket setup
+    #
+    def bind(self):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+            raise RuntimeError('A workon daemon is already listening on {}'.format(self.path))
+        except OSError:
+            pass
+        finally:
+            probe.close()
+
+        # Nothing is listening; the socket file is left over from a daemon
+        # that did not exit cleanly
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o077)
+        try:
+            listener.bind(self.path)
+        finally:
+            os.umask(umask)
+        listener.listen(16)
+        listener.setblocking(False)
+
+        self.listener = listener
+        self.watch(listener, self.accept)
+
+    def close(self):
+        if self.listener != None:
+            self.unwatch(self.listener)
+            self.listener.close()
+            self.listener = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+        self.selector.close()
+
+    #
+    # Signals
+    #
+    # Signal handlers only wake the loop; the signal numbers are read from
+    # the wakeup socket and handled there.
+    #
+    def install_signals(self):
+        reader,writer = socket.socketpair()
+        reader.setblocking(False)
+        writer.setblocking(False)
+        signal.set_wakeup_fd(writer.fileno())
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD):
+            signal.signal(sig, lambda signum, frame: None)
+
+        self.wakeup = (reader, writer)
+        self.watch(reader, self.on_signal)
+
+    def on_signal(self, reader):
+        try:
+            data = reader.recv(256)
+        except BlockingIOError:
+            return
+
+        for signum in data:
+            if signum == signal.SIGCHLD:
+                self.reap()
+            else:
+                self.running = False
+
+    def reap(self):
+        # Applications launched from the daemon are its children. Children
+        # claimed by a child owner are left for it to reap with their exit
+        # status; it calls reap() again once it has.
+        while True:
+            try:
+                info = os.waitid(os.P_ALL, 0, os.WEXITED | os.WNOHANG | os.WNOWAIT)
+            except ChildProcessError:
+                return
+            if info == None:
+                return
+            for owns in self.child_owners:
+                if owns(info.si_pid):
+                    return
+            try:
+                os.waitpid(info.si_pid, 0)
+            except ChildProcessError:
+                pass
+            launcher.forget(info.si_pid)
+
+    #
+    # Requests
+    #
+    def accept(self, listener):
+        try:
+            conn,addr = listener.accept()
+        except BlockingIOError:
+            return
+
+        try:
+            conn.settimeout(REQUEST_TIMEOUT)
+            message = read_message(conn)
+            conn.settimeout(None)
+            reply = handle(message)
+            conn.sendall(json.dumps(reply).encode())
+        except Exception as e:
+            print('Error serving request: {}'.format(e), flush=True)
+        finally:
+            conn.close()
+
+        self.sync()
+
+    def sync(self):
+        # Requests may have changed the saved state
+        for hook in self.sync_hooks:
+            try:
+                hook()
+            except Exception as e:
+                print('Error syncing state: {}'.format(e), flush=True)
+
+    def serve_forever(self):
+        self.bind()
+        self.install_signals()
+        self.running = True
+        self.sync()
+        print('workon daemon listening on {}'.format(self.path), flush=True)
+        try:
+            while self.running:
+                for key,events in self.selector.select(self.next_timeout()):
+                    key.data(key.fileobj)
+                self.run_timers()
+        finally:
+            for hook in self.stop_hooks:
+                try:
+                    hook()
+                except Exception as e:
+                    print('Error stopping: {}'.format(e), flush=True)
+            self.close()
+
+def read_message(conn):
+    chunks = []
+    size = 0
+    while True:
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size = size + len(chunk)
+        if size > MAX_REQUEST:
+            raise ValueError('request too large')
+    return json.loads(b''.join(chunks))
+
+@contextlib.contextmanager
+def client_environment(message):
+    # Run the request with the client's environment and working directory,
+    # so $PATH, $HOME and relative paths resolve as they would have in
+    # direct mode
+    saved_env = dict(os.environ)
+    saved_cwd = os.getcwd()
+    os.environ.clear()
+    os.environ.update(message.get('env', saved_env))
+    try:
+        os.chdir(message.get('cwd', saved_cwd))
+    except OSError:
+        pass
+
+    try:
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(saved_env)
+        os.chdir(saved_cwd)
+
+def handle(message):
+    from workon import cli,config
+
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    status = 0
+    with client_environment(message):
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            try:
+                # The parser's date defaults depend on the current day
+                parser = cli.build_parser()
+                args = parser.parse_args(message['argv'])
+                if cli.operation(args) not in SERVED:
+                    return {'fallback': True}
+
+                session = config.get_session()
+                if cli.bootstrap_done(session) == False:
+                    cli.bootstrap(session)
+                cli.run(args, parser, session)
+            except SystemExit as e:
+                if e.code == None:
+                    status = 0
+                elif isinstance(e.code, int):
+                    status = e.code
+                else:
+                    print(e.code, file=stderr)
+                    status = 1
+            except Exception as e:
+                print('Error: {}'.format(e), file=stderr)
+                status = 1
+
+    return {'stdout': stdout.getvalue(), 'stderr': stderr.getvalue(), 'status': status}
+
+def serve(path=None):
+    from workon import supervisor,sampler
+
+    daemon = Daemon(path)
+    supervisor.Supervisor(daemon)
+    sampler.Sampler(daemon)
+    try:
+        daemon.serve_forever()
+    except RuntimeError as e:
+        print(e)
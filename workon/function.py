@@ -1,82 +1,164 @@
 import os
 import sys
 import json
-import importlib
-from workon import config,context,function
+from workon import config,context,function,state
 
 #
 # Enhance module search path
 #
-cfg = config.read_config()
-funcdir = os.path.join(cfg['context_dir'], 'function_dir')
-sys.path.append(funcdir)
+def enable_function_path(session=None):
+    if session is None:
+        session = config.get_session()
+
+    if session.function_dir not in sys.path:
+        sys.path.append(session.function_dir)
 
 #
 # Function storage
 #
-def get_functions():
-    function_list = []
+def get_functions(session=None):
+    if session is None:
+        session = config.get_session()
 
-    cfg = config.read_config()
-    funcdir = os.path.join(cfg['context_dir'], 'function_dir')
-    for f in os.listdir(funcdir):
+    function_list = []
+    for f in os.listdir(session.function_dir):
         extension = os.path.splitext(f)[1]
         if extension == ".func":
             function_list.append(os.path.splitext(f)[0])
 
     return function_list
 
-def read_function(func):
-    cfg = config.read_config()
-    funcfile = os.path.join(cfg['context_dir'], 'function_dir', '{}.func'.format(func))
-    with open(funcfile) as fp:
+def read_function(func, session=None):
+    if session is None:
+        session = config.get_session()
+
+    with open(session.function_file(func)) as fp:
         function = json.load(fp)
 
     return function
 
-def add_function_to_context(ctx_name, func):
-    cfg = config.read_config()
-    ctx = context.read_context(ctx_name)
-    function = read_function(func)
+#
+# Compiled functions
+#
+# A function template is parsed once into a substitution plan: every
+# string is split into literal parts and placeholders, so applying it to
+# a context is a join rather than a chain of replaces. Only "command",
+# "args" and "env" are carried into the definition; "module" names an
+# initialization module whose init_function(context_dir, name) runs when
+# the function is added.
+#
+PLACEHOLDERS=('<name>', '<context_dir>')
+
+def compile_string(value):
+    import re
+
+    if isinstance(value, str) == False:
+        return value
+    parts = re.split('(<name>|<context_dir>)', value)
+    if len(parts) == 1:
+        return value
+    return tuple(parts)
+
+def render_string(parts, values):
+    if isinstance(parts, tuple) == False:
+        return parts
+    return ''.join([values.get(part, part) for part in parts])
+
+def compile_function(func, session=None):
+    tools = []
+    modules = []
+    for toolname,params in read_function(func, session).items():
+        plan = {}
+        for key,val in params.items():
+            if key == "command" or key == "args":
+                plan[key] = compile_string(val)
+            elif key == "env":
+                plan[key] = {var: compile_string(string) for var,string in val.items()}
+            elif key == "module":
+                modules.append(val)
+        tools.append((compile_string(toolname), plan))
+    return (tools, modules)
+
+def render_function(plan, ctx_name, context_dir):
+    values = {'<name>': ctx_name, '<context_dir>': context_dir}
+    tools,modules = plan
 
-    # Replace "<name>" with context name
-    newfunc = {}
-    module_name = ''
-    for toolname,params in function.items():
+    ctx = {}
+    for toolname,params in tools:
+        tool = {}
         for key,val in params.items():
+            if key == "env":
+                tool[key] = {var: render_string(string, values) for var,string in val.items()}
+            else:
+                tool[key] = render_string(val, values)
+        ctx[render_string(toolname, values)] = tool
+    return ctx
+
+#
+# Applying functions
+#
+# Any number of functions can be applied to any number of contexts in one
+# call. Contexts are given as names, comma-separated lists or shell
+# patterns. The initialization hooks run on a worker pool, then every
+# context definition is read, merged and written once, all under a single
+# hold of the state lock.
+#
+def run_init_hooks(hooks, context_dir, session):
+    import importlib
+    import concurrent.futures
+
+    failed = set()
+    if len(hooks) == 0:
+        return failed
+
+    enable_function_path(session)
+    functions = {}
+    for module_name in set(module_name for ctx_name,module_name in hooks):
+        functions[module_name] = importlib.import_module(module_name).init_function
+
+    workers = max(1, int(session.cfg.get('function_threads', min(32, (os.cpu_count() or 1) * 4))))
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        futures = {}
+        for ctx_name,module_name in hooks:
+            futures[pool.submit(functions[module_name], context_dir, ctx_name)] = (ctx_name, module_name)
+        for future,(ctx_name,module_name) in futures.items():
             try:
-                if key == "command":
-                    newfunc[key] = val.replace("<name>", ctx_name)
-                    newfunc[key] = newfunc[key].replace("<context_dir>", cfg['context_dir'])
-                elif key == "args":
-                    newfunc[key] = val.replace("<name>", ctx_name)
-                    newfunc[key] = newfunc[key].replace("<context_dir>", cfg['context_dir'])
-                elif key == "env":
-                    env = {}
-                    for var,string in val.items():
-                        try:
-                            env[var] = string.replace("<name>", ctx_name)
-                            env[var] = env[var].replace("<context_dir>", cfg['context_dir'])
-                        except:
-                            pass
-                    newfunc[key] = env
-                elif key == "module":
-                    module_name = val
-            except:
-                pass
-
-        try:
-            toolname = toolname.replace("<name>", ctx_name)
-            toolname = toolname.replace("<context_dir>", cfg['context_dir'])
-        except:
-            pass
-        ctx[toolname] = newfunc
-
-    # Initialize the function is an initialization module provided
-    cfg = config.read_config()
-    if len(module_name) > 0:
-        toolmod = importlib.import_module(module_name)
-        toolmod.init_function(cfg['context_dir'], ctx_name)
-
-    ctxfile = os.path.join(os.environ['HOME'], cfg['context_dir'], ctx_name + '.json')
-    context.write_context(ctxfile, ctx)
+                future.result()
+            except Exception as e:
+                print('Error initializing {} for {} ({})'.format(module_name, ctx_name, e))
+                failed.add(ctx_name)
+    return failed
+
+def apply_functions(funcs, contexts, session=None):
+    if session is None:
+        session = config.get_session()
+
+    context_dir = session.context_dir
+    plans = [compile_function(func, session) for func in funcs]
+
+    targets = []
+    for ctx_name in contexts:
+        if os.path.exists(session.context_file(ctx_name)):
+            targets.append(ctx_name)
+        else:
+            print('Error adding function to {} (no such context)'.format(ctx_name))
+
+    hooks = []
+    for ctx_name in targets:
+        for tools,modules in plans:
+            for module_name in modules:
+                hooks.append((ctx_name, module_name))
+    failed = run_init_hooks(hooks, context_dir, session)
+
+    # Merge into the definitions as they are now, under the state lock
+    with state.locked(session):
+        for ctx_name in targets:
+            if ctx_name in failed:
+                continue
+            definition = context.read_context(ctx_name, session)
+            for plan in plans:
+                definition.update(render_function(plan, ctx_name, context_dir))
+            context.write_context(session.context_file(ctx_name), definition)
+
+def add_function_to_context(ctx_name, func, session=None):
+    apply_functions([func], [ctx_name], session)
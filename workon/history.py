@@ -1,36 +1,108 @@
-import os
-import json
-from workon import config
-
-HISTORY_FILE='.history.json'
+import math
+from workon import config,storage
 
 #
 # History Storage
 #
-def read_history():
-    cfg = config.read_config()
-    histfile = os.path.join(cfg['context_dir'], HISTORY_FILE)
-    try:
-        with open(histfile, 'r') as fp:
-            hist = json.load(fp)
-    except:
-        hist = {}
+# Last access times live in the access_history table of the time tracking
+# database. Unlike the catalog, it survives a catalog rebuild.
+#
+def read_history(session=None):
+    connection = storage.get_connection(session)
+
+    hist = {}
+    for ctx,last_access in connection.execute('SELECT context, last_access FROM access_history'):
+        hist[ctx] = str(last_access)
     return hist
 
-def write_history(hist):
-    cfg = config.read_config()
-    histfile = os.path.join(cfg['context_dir'], HISTORY_FILE)
-    with open(histfile, 'w') as fp:
-        json.dump(hist, fp)
+def write_history(hist, session=None):
+    with storage.transaction(session) as connection:
+        connection.execute('DELETE FROM access_history')
+        connection.execute('DELETE FROM access_log')
+        rows = [(ctx, float(last_access)) for ctx,last_access in hist.items()]
+        connection.executemany('INSERT INTO access_history(context, last_access) VALUES(?, ?)', rows)
+        connection.executemany('INSERT INTO access_log(context, ts) VALUES(?, ?)', rows)
+        connection.execute('DELETE FROM catalog_meta WHERE key=?', ('frecency_rate',))
+
+#
+# Frecency
+#
+# Every switch appends to the access log. A context's frecency is the sum
+# of exp(-rate * age) over its accesses, with the rate set by the
+# frecency_half_life configuration (seconds, default one week). That sum
+# changes with time, but its order does not, so access_history stores the
+# time-independent key log(sum(exp(rate * ts))) and indexes it. Each
+# access updates the key in O(1) and the top contexts are read straight
+# off the index.
+#
+# The log is compacted every ACCESS_LOG_COMPACT_EVERY entries: a
+# context's accesses older than ACCESS_LOG_RETENTION are folded into a
+# single entry at the time that carries the same weight, so recomputing
+# the keys from the log gives the same result. The keys are recomputed
+# from the log when the half-life changes.
+#
+FRECENCY_HALF_LIFE=7 * 86400
+ACCESS_LOG_RETENTION=30 * 86400
+ACCESS_LOG_COMPACT_EVERY=1000
+
+def decay_rate(session=None):
+    if session is None:
+        session = config.get_session()
+    return math.log(2) / session.cfg.get('frecency_half_life', FRECENCY_HALF_LIFE)
+
+def logaddexp(a, b):
+    if a == None:
+        return b
+    if b == None:
+        return a
+    high = max(a, b)
+    return high + math.log1p(math.exp(-abs(a - b)))
+
+def logsumexp(values):
+    total = None
+    for value in values:
+        total = logaddexp(total, value)
+    return total
+
+def rebuild_frecency(connection, rate):
+    keys = {}
+    for ctx,ts in connection.execute('SELECT context, ts FROM access_log'):
+        keys[ctx] = logaddexp(keys.get(ctx), rate * ts)
+
+    connection.execute('UPDATE access_history SET frecency=? * last_access', (rate,))
+    connection.executemany('UPDATE access_history SET frecency=? WHERE context=?',
+                           [(key, ctx) for ctx,key in keys.items()])
+    connection.execute('INSERT OR REPLACE INTO catalog_meta(key, value) VALUES(?, ?)', ('frecency_rate', rate))
+
+def ensure_frecency(session=None):
+    # Recompute the keys if they were made with another half-life
+    rate = decay_rate(session)
+    connection = storage.get_connection(session)
+    res = connection.execute('SELECT value FROM catalog_meta WHERE key=?', ('frecency_rate',)).fetchone()
+    if res == None or float(res[0]) != rate:
+        with storage.transaction(session) as connection:
+            rebuild_frecency(connection, rate)
+    return rate
+
+def compact_access_log(connection, cutoff, rate):
+    folded = {}
+    for ctx,ts in connection.execute('SELECT context, ts FROM access_log WHERE ts<?', (cutoff,)):
+        folded.setdefault(ctx, []).append(rate * ts)
 
-def extended_history(hist, context):
-    extended_hist = []
-    for ctx in context:
-        if ctx in hist:
-            extended_hist.append(hist[ctx])
-        else:
-            extended_hist.append(0)
+    connection.execute('DELETE FROM access_log WHERE ts<?', (cutoff,))
+    connection.executemany('INSERT INTO access_log(context, ts) VALUES(?, ?)',
+                           [(ctx, logsumexp(keys) / rate) for ctx,keys in folded.items()])
 
-    return extended_hist
+def record_access(context, access_time, session=None):
+    rate = ensure_frecency(session)
+    with storage.transaction(session) as connection:
+        res = connection.execute('INSERT INTO access_log(context, ts) VALUES(?, ?)', (context, access_time))
+        entry = res.lastrowid
 
+        res = connection.execute('SELECT frecency FROM access_history WHERE context=?', (context,)).fetchone()
+        frecency = logaddexp(res[0] if res != None else None, rate * access_time)
+        connection.execute('INSERT OR REPLACE INTO access_history(context, last_access, frecency) VALUES(?, ?, ?)',
+                           (context, access_time, frecency))
 
+        if entry % ACCESS_LOG_COMPACT_EVERY == 0:
+            compact_access_log(connection, access_time - ACCESS_LOG_RETENTION, rate)
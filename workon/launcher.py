@@ -0,0 +1,319 @@
+import os
+import sys
+import json
+import time
+import threading
+from workon import config,process,state
+
+READY_TIMEOUT=30.0
+READY_POLL=0.05
+PLAN_VERSION=3
+
+#
+# Path Helpers
+#
+def find_command(command):
+    cmdpath = ''
+    for path in os.environ['PATH'].split(':'):
+        if os.path.exists(os.path.join(path, command)):
+            cmdpath = os.path.join(path,command)
+            break
+
+    return cmdpath
+
+#
+# Launch planning
+#
+# Each application in a context definition may name the applications it
+# depends on ("depends_on") and how to tell that it is ready ("ready").
+# Applications start as soon as everything they depend on is ready, so
+# independent applications start concurrently.
+#
+def dependencies(actions):
+    depends_on = actions.get('depends_on', [])
+    if isinstance(depends_on, str):
+        depends_on = [depends_on]
+    return list(depends_on)
+
+def resolve_app(key, actions, support_dir):
+    # Extract the command string
+    command = actions['command']
+    if command[0] != '/':
+        command = find_command(command)
+
+    if len(command) == 0:
+        return None
+
+    # Extract the command arguments
+    try:
+        arguments = actions['args'].split()
+    except:
+        arguments = []
+
+    # Extract the working directory
+    workdir = actions.get('workdir', support_dir)
+    if os.path.isdir(workdir) == False:
+        workdir = support_dir
+
+    return {
+        'command': command,
+        'argv': [command] + arguments,
+        'workdir': workdir,
+        'env': dict(actions.get('env', {})),
+        'depends_on': dependencies(actions),
+        'ready': actions.get('ready'),
+        'restart': actions.get('restart'),
+        'limits': actions.get('limits'),
+    }
+
+def launch_order(apps, unavailable=()):
+    # Drop unknown dependencies and applications that are part of a cycle
+    for key,app in apps.items():
+        for dep in list(app['depends_on']):
+            if dep not in apps and dep not in unavailable:
+                print('Unknown dependency {} for {}'.format(dep, key))
+                app['depends_on'].remove(dep)
+
+    order = []
+    visiting = set()
+    done = set()
+    cyclic = set()
+
+    def visit(key):
+        if key in done:
+            return key not in cyclic
+        if key in visiting:
+            return False
+        visiting.add(key)
+        ok = True
+        for dep in apps[key]['depends_on']:
+            if dep in unavailable:
+                continue
+            if visit(dep) == False:
+                ok = False
+        visiting.discard(key)
+        done.add(key)
+        if ok:
+            order.append(key)
+        else:
+            cyclic.add(key)
+        return ok
+
+    for key in apps:
+        visit(key)
+
+    for key in apps:
+        if key in cyclic:
+            print('Dependency cycle, not starting: {}'.format(key))
+
+    return order
+
+#
+# Readiness probes
+#
+def probe(ready, workdir):
+    import socket
+
+    if 'file' in ready:
+        return os.path.exists(os.path.join(workdir, os.path.expanduser(ready['file'])))
+
+    if 'socket' in ready:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(os.path.join(workdir, os.path.expanduser(ready['socket'])))
+            return True
+        except OSError:
+            return False
+        finally:
+            sock.close()
+
+    if 'tcp' in ready:
+        host,port = 'localhost',ready['tcp']
+        if isinstance(port, str) and ':' in port:
+            host,port = port.rsplit(':', 1)
+        try:
+            socket.create_connection((host, int(port)), timeout=1.0).close()
+            return True
+        except OSError:
+            return False
+
+    return True
+
+def wait_ready(key, ready, workdir):
+    if ready == None:
+        return
+
+    if 'delay' in ready:
+        time.sleep(float(ready['delay']))
+
+    deadline = time.time() + float(ready.get('timeout', READY_TIMEOUT))
+    while probe(ready, workdir) == False:
+        if time.time() > deadline:
+            print('Timed out waiting for {} to become ready'.format(key))
+            return
+        time.sleep(READY_POLL)
+
+#
+# Launching
+#
+# Popen objects are kept until their process has been reaped. A discarded
+# Popen is reaped by the subprocess module itself on a later spawn, which
+# would lose the exit status the daemon's supervisor records.
+#
+_children = {}
+
+def forget(pid, status=None):
+    proc = _children.pop(pid, None)
+    if proc != None:
+        proc.returncode = status if status != None else 0
+
+def spawn(app):
+    import subprocess
+
+    spawnenv = dict(os.environ)
+    spawnenv.update(app['env'])
+
+    # Each application leads its own process group so that it can be
+    # stopped, resumed and terminated as a whole
+    if sys.version_info >= (3, 11):
+        group = {'process_group': 0}
+    else:
+        group = {'preexec_fn': os.setpgrp}
+
+    proc = subprocess.Popen(app['argv'], executable=app['command'], cwd=app['workdir'], env=spawnenv, **group)
+    _children[proc.pid] = proc
+    return proc.pid
+
+def launch_apps(apps, unavailable=()):
+    launched = {}
+    started = {}
+    failed = set(unavailable)
+    lock = threading.Lock()
+
+    order = launch_order(apps, failed)
+    for key in order:
+        started[key] = threading.Event()
+    for key in failed:
+        started[key] = threading.Event()
+        started[key].set()
+
+    def run(key):
+        app = apps[key]
+        try:
+            for dep in app['depends_on']:
+                started[dep].wait()
+            with lock:
+                blocked = [dep for dep in app['depends_on'] if dep in failed]
+            if len(blocked) > 0:
+                print('Not starting {}: {} failed to start'.format(key, ', '.join(blocked)))
+                with lock:
+                    failed.add(key)
+                return
+
+            pid = spawn(app)
+            with lock:
+                launched[key] = (pid,time.time(),process.start_time(pid))
+            wait_ready(key, app['ready'], app['workdir'])
+        except Exception as e:
+            print('Error starting {} ({})'.format(key, e))
+            with lock:
+                failed.add(key)
+        finally:
+            started[key].set()
+
+    threads = []
+    for key in order:
+        thread = threading.Thread(target=run, args=(key,))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+    # Keep the definition order in the saved state
+    app_info = {}
+    for key in apps:
+        if key in launched:
+            app_info[key] = launched[key]
+    return app_info
+
+#
+# Compiled launch plans
+#
+# Resolving a context means a PATH walk per application, so the resolved
+# plan is cached per context. The cache key covers everything resolution
+# depends on: the definition file, $PATH and the directories on it.
+#
+def compile_plan(ctx, support_dir):
+    apps = {}
+    unavailable = {}
+    for key,actions in ctx.items():
+        app = resolve_app(key, actions, support_dir)
+        if app == None:
+            unavailable[key] = actions['command']
+        else:
+            apps[key] = app
+
+    return {'apps': apps, 'unavailable': unavailable}
+
+def plan_key(ctxfile, support_dir):
+    st = os.stat(ctxfile)
+    path = os.environ.get('PATH', '')
+    path_dirs = []
+    for directory in path.split(':'):
+        try:
+            path_dirs.append([directory, os.stat(directory).st_mtime_ns])
+        except OSError:
+            path_dirs.append([directory, None])
+
+    return {
+        'version': PLAN_VERSION,
+        'context': [st.st_mtime_ns, st.st_size],
+        'support_dir': support_dir,
+        'path': path,
+        'path_dirs': path_dirs,
+    }
+
+def write_plan(planfile, plan):
+    try:
+        os.makedirs(os.path.dirname(planfile), exist_ok=True)
+        # The plan is a cache and is rebuilt if lost, so skip the fsync
+        state.write_atomic(planfile, json.dumps(plan), sync=False)
+    except Exception as e:
+        print('Error caching launch plan: {}'.format(e))
+
+def get_plan(context_name, session=None):
+    if session is None:
+        session = config.get_session()
+
+    ctxfile = session.context_file(context_name)
+    support_dir = session.support_dir(context_name)
+    planfile = session.plan_file(context_name)
+    key = plan_key(ctxfile, support_dir)
+
+    try:
+        with open(planfile) as fp:
+            plan = json.load(fp)
+        if plan['key'] == key:
+            return plan
+    except:
+        pass
+
+    from workon import context
+    plan = compile_plan(context.read_context(context_name, session), support_dir)
+    plan['key'] = key
+    write_plan(planfile, plan)
+    return plan
+
+def launch_plan(plan, running=()):
+    for key,command in plan['unavailable'].items():
+        print('Error finding command: {}'.format(command))
+
+    # The cached plan is shared; launching must not modify it. Applications
+    # that are still running are not started again and count as started
+    # for the applications depending on them.
+    apps = {}
+    for key,app in plan['apps'].items():
+        if key not in running:
+            apps[key] = dict(app, depends_on=[dep for dep in app['depends_on'] if dep not in running])
+
+    return launch_apps(apps, set(plan['unavailable']))
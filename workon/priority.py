@@ -0,0 +1,174 @@
+import os
+from workon import config,process
+
+FOREGROUND_NICE=0
+BACKGROUND_NICE=10
+MiB=1024 * 1024
+
+#
+# I/O priorities
+#
+# Python has no binding for ioprio_set(2), so it is called through libc's
+# syscall() with the architecture's syscall number.
+#
+IOPRIO_CLASS_SHIFT=13
+IOPRIO_CLASS_NONE=0
+IOPRIO_CLASS_BE=2
+IOPRIO_CLASS_IDLE=3
+IOPRIO_WHO_PROCESS=1
+IOPRIO_WHO_PGRP=2
+
+IOPRIO_SET={
+    'x86_64': 251,
+    'i386': 289,
+    'i686': 289,
+    'aarch64': 30,
+    'riscv64': 30,
+    'armv7l': 314,
+    'ppc64le': 273,
+    's390x': 282,
+}
+
+_libc = None
+
+def ioprio_set(which, who, ioclass, level=0):
+    global _libc
+    import ctypes
+    import platform
+
+    number = IOPRIO_SET.get(platform.machine())
+    if number == None:
+        return False
+
+    if _libc is None:
+        _libc = ctypes.CDLL(None, use_errno=True)
+    if _libc.syscall(number, which, who, (ioclass << IOPRIO_CLASS_SHIFT) | level) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return True
+
+#
+# Foreground and background contexts
+#
+# When several contexts run at once (-a), only the active one keeps normal
+# CPU and I/O priority. The applications of the others are reniced to
+# background_nice (default 10) and moved to the idle I/O class (or
+# best-effort at the lowest level with background_ioclass set to
+# "best-effort"). An application may also declare "limits" in the context
+# definition: {"as": <MiB>, "cpu": <seconds>}. While in the background its
+# soft RLIMIT_AS is lowered to "as" and its soft RLIMIT_CPU allows "cpu"
+# more seconds; the soft limits go back to the hard limits when the
+# context returns to the foreground. Set "priorities" to false to disable.
+#
+# Lowering a nice value again needs CAP_SYS_NICE or a matching RLIMIT_NICE
+# (unprivileged users usually have none), so applications are only reniced
+# when foreground_nice could be restored later. Otherwise only their I/O
+# priority and limits change, which can always be undone.
+#
+def enabled(session=None):
+    if session is None:
+        session = config.get_session()
+    return session.cfg.get('priorities', True) != False
+
+def can_lower_nice(pid, nice):
+    import resource
+
+    if os.geteuid() == 0:
+        return True
+    soft,hard = resource.prlimit(pid, resource.RLIMIT_NICE)
+    # RLIMIT_NICE allows nice values down to 20 - limit
+    return soft == resource.RLIM_INFINITY or 20 - nice <= soft
+
+def set_priority(pid, nice, ioclass, level, foreground_nice=FOREGROUND_NICE):
+    if process.is_group_leader(pid):
+        which,io_who = os.PRIO_PGRP,IOPRIO_WHO_PGRP
+    else:
+        which,io_who = os.PRIO_PROCESS,IOPRIO_WHO_PROCESS
+
+    current = os.getpriority(which, pid)
+    lowest = min(nice, foreground_nice)
+    if current != nice and (lowest >= max(current, nice) or can_lower_nice(pid, lowest)):
+        os.setpriority(which, pid, nice)
+    ioprio_set(io_who, pid, ioclass, level)
+
+def cpu_seconds(pid):
+    stat = process.read_stat(pid)
+    return (int(stat[11]) + int(stat[12])) // process.CLK_TCK
+
+def set_limits(pid, limits, background):
+    import resource
+
+    if process.is_group_leader(pid):
+        pids = process.group_members(pid)
+    else:
+        pids = [pid]
+
+    for member in pids:
+        if 'as' in limits:
+            soft,hard = resource.prlimit(member, resource.RLIMIT_AS)
+            if background:
+                soft = int(limits['as'] * MiB)
+                if hard != resource.RLIM_INFINITY:
+                    soft = min(soft, hard)
+            else:
+                soft = hard
+            resource.prlimit(member, resource.RLIMIT_AS, (soft, hard))
+
+        if 'cpu' in limits:
+            soft,hard = resource.prlimit(member, resource.RLIMIT_CPU)
+            if background:
+                soft = cpu_seconds(member) + int(limits['cpu'])
+                if hard != resource.RLIM_INFINITY:
+                    soft = min(soft, hard)
+            else:
+                soft = hard
+            resource.prlimit(member, resource.RLIMIT_CPU, (soft, hard))
+
+def apply_priorities(current_context, foreground, session=None):
+    from workon import launcher
+
+    if session is None:
+        session = config.get_session()
+    if enabled(session) == False:
+        return
+
+    if session.cfg.get('background_ioclass', 'idle') == 'best-effort':
+        background_io = (IOPRIO_CLASS_BE, 7)
+    else:
+        background_io = (IOPRIO_CLASS_IDLE, 0)
+
+    foreground_nice = session.cfg.get('foreground_nice', FOREGROUND_NICE)
+    for ctx,apps in current_context.items():
+        background = ctx != foreground
+        if background:
+            nice = session.cfg.get('background_nice', BACKGROUND_NICE)
+            ioclass,level = background_io
+        else:
+            nice = foreground_nice
+            ioclass,level = IOPRIO_CLASS_NONE,0
+
+        try:
+            specs = launcher.get_plan(ctx, session)['apps']
+        except Exception:
+            specs = {}
+
+        for app,info in apps.items():
+            if process.same_process(info) == False:
+                continue
+            try:
+                set_priority(info[0], nice, ioclass, level, foreground_nice)
+                limits = specs.get(app, {}).get('limits')
+                if limits:
+                    set_limits(info[0], limits, background)
+            except OSError as e:
+                print('Cannot change priority of {}/{} ({})'.format(ctx, app, e))
+
+def most_recent(current_context, session=None):
+    from workon import history
+
+    hist = history.read_history(session)
+    recent = None
+    for ctx in current_context:
+        if recent == None or float(hist.get(ctx, 0)) > float(hist.get(recent, 0)):
+            recent = ctx
+    return recent
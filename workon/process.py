@@ -0,0 +1,138 @@
+import os
+
+#
+# Process helpers
+#
+# Applications are launched as the leaders of their own process groups, so
+# signals reach every process an application starts. Entries recorded by
+# older versions of workon are plain PIDs and are signalled individually.
+#
+PAGE_SIZE=os.sysconf('SC_PAGE_SIZE')
+CLK_TCK=os.sysconf('SC_CLK_TCK')
+
+def is_group_leader(pid):
+    try:
+        return os.getpgid(pid) == pid
+    except OSError:
+        return False
+
+def signal_app(pid, sig):
+    if is_group_leader(pid):
+        os.killpg(pid, sig)
+    else:
+        os.kill(pid, sig)
+
+def alive(pid):
+    try:
+        with open('/proc/{}/stat'.format(pid)) as fp:
+            stat = fp.read()
+        # A zombie has exited and is only waiting to be reaped
+        return stat[stat.rindex(')') + 2] != 'Z'
+    except (OSError, ValueError, IndexError):
+        return False
+
+def read_stat(pid):
+    # Fields after the command name, which may itself contain spaces or
+    # parentheses; index 0 is the process state (field 3 in proc(5))
+    with open('/proc/{}/stat'.format(pid)) as fp:
+        stat = fp.read()
+    return stat[stat.rindex(')') + 2:].split()
+
+def group_members(pgid):
+    return process_groups().get(pgid, [])
+
+def rss_bytes(pid):
+    try:
+        with open('/proc/{}/statm'.format(pid)) as fp:
+            return int(fp.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+def app_rss(pid):
+    if is_group_leader(pid):
+        total = 0
+        for member in group_members(pid):
+            total = total + rss_bytes(member)
+        return total
+    return rss_bytes(pid)
+
+#
+# Process identity
+#
+# A PID may be reused once the original process exits. The start time in
+# /proc/<pid>/stat (clock ticks since boot) is recorded at spawn and must
+# match before a saved PID is signalled.
+#
+def start_time(pid):
+    try:
+        return int(read_stat(pid)[19])
+    except (OSError, ValueError, IndexError):
+        return None
+
+def same_process(info):
+    pid = info[0]
+    if alive(pid) == False:
+        return False
+    if len(info) > 2 and info[2] != None:
+        return start_time(pid) == info[2]
+    return True
+
+def process_groups():
+    groups = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                pgid = int(read_stat(entry)[2])
+            except (OSError, ValueError, IndexError):
+                continue
+            groups.setdefault(pgid, []).append(int(entry))
+    return groups
+
+#
+# Resource snapshots
+#
+# One pass over /proc collecting, per process: parent, process group, CPU
+# time including reaped children (clock ticks), start time and RSS (pages).
+# Like the CPU time, /proc/<pid>/io includes the I/O of reaped children.
+#
+def snapshot():
+    procs = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                stat = read_stat(entry)
+                procs[int(entry)] = (int(stat[1]), int(stat[2]),
+                                     int(stat[11]) + int(stat[12]) + int(stat[13]) + int(stat[14]),
+                                     int(stat[19]), int(stat[21]))
+            except (OSError, ValueError, IndexError):
+                continue
+    return procs
+
+def process_tree(pid, procs, children, groups):
+    # The application's process group plus every descendant, including
+    # those that moved to a group of their own
+    if procs[pid][1] == pid:
+        tree = set(groups.get(pid, [pid]))
+    else:
+        tree = {pid}
+    queue = list(tree)
+    while len(queue) > 0:
+        for child in children.get(queue.pop(), []):
+            if child not in tree:
+                tree.add(child)
+                queue.append(child)
+    return tree
+
+def io_bytes(pid):
+    read_bytes = 0
+    write_bytes = 0
+    try:
+        with open('/proc/{}/io'.format(pid)) as fp:
+            for line in fp:
+                if line.startswith('read_bytes:'):
+                    read_bytes = int(line.split()[1])
+                elif line.startswith('write_bytes:'):
+                    write_bytes = int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return read_bytes,write_bytes
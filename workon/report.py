@@ -0,0 +1,173 @@
+import json
+from workon import config,catalog,tracking,rollup
+
+GROUPINGS=['context', 'day', 'week', 'month']
+FORMATS=['table', 'json', 'csv']
+
+#
+# Time spent reporting
+#
+def time_spent_report(begin, end, group_by='context', top=None, session=None):
+    if session is None:
+        session = config.get_session()
+
+    begin = int(begin)
+    end = int(end)
+    if begin > end:
+        begin = end
+
+    catalog.sync(session)
+    connection = tracking.connect(session)
+
+    source,params = rollup.range_source(begin, end, group_by)
+
+    # Only live contexts are reported
+    where = 'context IN (SELECT name FROM catalog WHERE archived=0)'
+
+    if top != None:
+        totals,total_params = rollup.range_source(begin, end)
+        where = where + (' AND context IN (SELECT context FROM ({}) WHERE {} '
+                         'GROUP BY context ORDER BY SUM(spent) DESC LIMIT ?)').format(totals, where)
+        params = params + total_params + [int(top)]
+
+    if group_by == 'context':
+        command = ('SELECT NULL, context, SUM(spent) FROM ({}) WHERE {} '
+                   'GROUP BY context ORDER BY SUM(spent) DESC, context').format(source, where)
+    else:
+        command = ('SELECT period, context, SUM(spent) FROM ({}) WHERE {} '
+                   'GROUP BY period, context ORDER BY period, SUM(spent) DESC, context').format(source, where)
+
+    rows = []
+    for period,ctx,spent in connection.execute(command, params):
+        rows.append({'period': period, 'context': ctx, 'spent': float(spent)})
+
+    return rows
+
+def report_total(rows):
+    total = 0
+    for row in rows:
+        total = total + row['spent']
+    return total
+
+#
+# Report output
+#
+def format_table(rows, group_by='context'):
+    lines = []
+    for row in rows:
+        if group_by == 'context':
+            lines.append('{:.<16} (Time spent: {})'.format(
+                row['context'], tracking.pretty_time_spent(row['spent'])))
+        else:
+            lines.append('{:<8} {:.<16} (Time spent: {})'.format(
+                row['period'], row['context'], tracking.pretty_time_spent(row['spent'])))
+
+    total = tracking.pretty_time_spent(report_total(rows))
+    if group_by == 'context':
+        lines.append('{:.<16} (Time spent: {})'.format('TOTAL', total))
+    else:
+        lines.append('{:<8} {:.<16} (Time spent: {})'.format('', 'TOTAL', total))
+
+    return '\n'.join(lines)
+
+def format_json(rows, begin, end, group_by='context'):
+    report = {
+        'begin': int(begin),
+        'end': int(end),
+        'group_by': group_by,
+        'rows': rows,
+        'total': report_total(rows),
+    }
+    if group_by == 'context':
+        for row in rows:
+            del row['period']
+
+    return json.dumps(report, indent=2)
+
+def format_csv(rows, group_by='context'):
+    import csv
+    import io
+
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator='\n')
+    if group_by == 'context':
+        writer.writerow(['context', 'spent'])
+        for row in rows:
+            writer.writerow([row['context'], row['spent']])
+    else:
+        writer.writerow([group_by, 'context', 'spent'])
+        for row in rows:
+            writer.writerow([row['period'], row['context'], row['spent']])
+
+    return out.getvalue().rstrip('\n')
+
+def format_report(rows, begin, end, group_by='context', output='table'):
+    if output == 'json':
+        return format_json(rows, begin, end, group_by)
+    elif output == 'csv':
+        return format_csv(rows, group_by)
+    else:
+        return format_table(rows, group_by)
+
+#
+# Resource usage reporting
+#
+def usage_report(begin, end, top=None, session=None):
+    if session is None:
+        session = config.get_session()
+
+    begin = int(begin)
+    end = int(end)
+    if begin > end:
+        begin = end
+
+    catalog.sync(session)
+    connection = tracking.connect(session)
+
+    command = ('SELECT context, SUM(cpu), MAX(rss_peak), SUM(rss_total) / MAX(SUM(samples), 1), '
+               'SUM(read_bytes), SUM(write_bytes) FROM context_usage '
+               'WHERE date BETWEEN ? AND ? AND context IN (SELECT name FROM catalog WHERE archived=0) '
+               'GROUP BY context ORDER BY SUM(cpu) DESC, context')
+    params = [begin, end]
+    if top != None:
+        command = command + ' LIMIT ?'
+        params.append(int(top))
+
+    rows = []
+    for ctx,cpu,rss_peak,rss_avg,read_bytes,write_bytes in connection.execute(command, params):
+        rows.append({'context': ctx, 'cpu': float(cpu), 'rss_peak': int(rss_peak), 'rss_avg': int(rss_avg),
+                     'read_bytes': int(read_bytes), 'write_bytes': int(write_bytes)})
+
+    return rows
+
+def pretty_bytes(count):
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if count < 1024:
+            return '{:.1f}{}'.format(count, unit)
+        count = count / 1024
+    return '{:.1f}TiB'.format(count)
+
+USAGE_COLUMNS=['context', 'cpu', 'rss_peak', 'rss_avg', 'read_bytes', 'write_bytes']
+
+def format_usage(rows, begin, end, output='table'):
+    if output == 'json':
+        return json.dumps({'begin': int(begin), 'end': int(end), 'rows': rows}, indent=2)
+
+    if output == 'csv':
+        import csv
+        import io
+
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator='\n')
+        writer.writerow(USAGE_COLUMNS)
+        for row in rows:
+            writer.writerow([row[column] for column in USAGE_COLUMNS])
+        return out.getvalue().rstrip('\n')
+
+    lines = []
+    for row in rows:
+        lines.append('{:.<16} (CPU: {}, RSS peak: {}, RSS avg: {}, Read: {}, Written: {})'.format(
+            row['context'], tracking.pretty_time_spent(row['cpu']).strip(),
+            pretty_bytes(row['rss_peak']), pretty_bytes(row['rss_avg']),
+            pretty_bytes(row['read_bytes']), pretty_bytes(row['write_bytes'])))
+    return '\n'.join(lines)
@@ -0,0 +1,155 @@
+from datetime import date,timedelta
+
+# SQL expression giving the Monday (as YYYYMMDD) of the week containing a
+# YYYYMMDD integer column.
+def week_sql(column):
+    return ("CAST(strftime('%Y%m%d', printf('%04d-%02d-%02d', {0}/10000, {0}/100%100, {0}%100), "
+            "'-6 days', 'weekday 1') AS INTEGER)").format(column)
+
+#
+# Rollup maintenance
+#
+# Completed days never change, so time spent is also accumulated into
+# weekly, monthly and yearly buckets as it is recorded. Range queries read
+# whole buckets from the rollup table and only touch raw daily rows at the
+# edges of the range.
+#
+def to_date(day):
+    day = int(day)
+    return date(day // 10000, day // 100 % 100, day % 100)
+
+def to_int(day):
+    return day.year * 10000 + day.month * 100 + day.day
+
+def buckets(day):
+    d = to_date(day)
+    monday = d - timedelta(days=d.weekday())
+    return [('year', d.year), ('month', d.year * 100 + d.month), ('week', to_int(monday))]
+
+def record(connection, context, day, elapsed):
+    for span,bucket in buckets(day):
+        connection.execute('INSERT INTO time_spent_rollup(span, bucket, context, spent) VALUES(?, ?, ?, ?) '
+                           'ON CONFLICT(span, bucket, context) DO UPDATE SET spent=spent+excluded.spent',
+                           (span, bucket, context, elapsed))
+
+def expected_rollups_sql():
+    return ('SELECT \'year\' AS span, date/10000 AS bucket, context, SUM(spent) AS spent FROM time_spent GROUP BY 2, 3 '
+            'UNION ALL SELECT \'month\', date/100, context, SUM(spent) FROM time_spent GROUP BY 2, 3 '
+            'UNION ALL SELECT \'week\', {0}, context, SUM(spent) FROM time_spent GROUP BY 2, 3').format(week_sql('date'))
+
+def rebuild(connection):
+    connection.execute('DELETE FROM time_spent_rollup')
+    connection.execute('INSERT INTO time_spent_rollup(span, bucket, context, spent) ' + expected_rollups_sql())
+    connection.commit()
+
+def verify(connection, tolerance=1e-6):
+    mismatches = []
+    expected = {}
+    for span,bucket,ctx,spent in connection.execute(expected_rollups_sql()):
+        expected[(span, bucket, ctx)] = float(spent)
+
+    actual = {}
+    for span,bucket,ctx,spent in connection.execute('SELECT span, bucket, context, spent FROM time_spent_rollup'):
+        actual[(span, bucket, ctx)] = float(spent)
+
+    for key in sorted(set(expected) | set(actual), key=str):
+        want = expected.get(key, 0.0)
+        have = actual.get(key, 0.0)
+        if abs(want - have) > tolerance * max(1.0, abs(want)):
+            mismatches.append((key[0], key[1], key[2], want, have))
+
+    return mismatches
+
+#
+# Range planning
+#
+def last_of_month(d):
+    if d.month == 12:
+        return date(d.year, 12, 31)
+    return date(d.year, d.month + 1, 1) - timedelta(days=1)
+
+def cover(begin, end, span, plan):
+    if begin > end:
+        return
+
+    one_day = timedelta(days=1)
+    if span == 'year':
+        first = begin.year if begin == date(begin.year, 1, 1) else begin.year + 1
+        last = end.year if end == date(end.year, 12, 31) else end.year - 1
+        if first <= last:
+            plan.append(('year', first, last))
+            cover(begin, date(first, 1, 1) - one_day, 'month', plan)
+            cover(date(last, 12, 31) + one_day, end, 'month', plan)
+        else:
+            cover(begin, end, 'month', plan)
+
+    elif span == 'month':
+        first = begin if begin.day == 1 else last_of_month(begin) + one_day
+        last = end if end == last_of_month(end) else date(end.year, end.month, 1) - one_day
+        if first <= last:
+            plan.append(('month', first.year * 100 + first.month, last.year * 100 + last.month))
+            cover(begin, first - one_day, 'week', plan)
+            cover(last + one_day, end, 'week', plan)
+        elif (begin.year, begin.month) != (end.year, end.month):
+            # Keep weeks inside a single month so they can be reported per month
+            cover(begin, last_of_month(begin), 'week', plan)
+            cover(last_of_month(begin) + one_day, end, 'week', plan)
+        else:
+            cover(begin, end, 'week', plan)
+
+    elif span == 'week':
+        first = begin + timedelta(days=(7 - begin.weekday()) % 7)
+        last = end - timedelta(days=(end.weekday() + 1) % 7)
+        if first <= last:
+            plan.append(('week', to_int(first), to_int(last - timedelta(days=6))))
+            cover(begin, first - one_day, 'day', plan)
+            cover(last + one_day, end, 'day', plan)
+        else:
+            cover(begin, end, 'day', plan)
+
+    else:
+        plan.append(('day', to_int(begin), to_int(end)))
+
+def plan_range(begin, end, coarsest='year'):
+    plan = []
+    cover(to_date(begin), to_date(end), coarsest, plan)
+    return plan
+
+# Coarsest rollup that can be attributed to a single reporting period
+COARSEST_SPAN={
+    'context': 'year',
+    'month': 'month',
+    'week': 'week',
+    'day': 'day',
+}
+
+def day_period_sql(group_by):
+    if group_by == 'day':
+        return 'date'
+    elif group_by == 'week':
+        return week_sql('date')
+    elif group_by == 'month':
+        return 'date/100'
+    return 'NULL'
+
+def bucket_period_sql(span, group_by):
+    if group_by == 'month' and span == 'week':
+        return 'bucket/100'
+    elif group_by == 'context':
+        return 'NULL'
+    return 'bucket'
+
+def range_source(begin, end, group_by='context'):
+    parts = []
+    params = []
+    for span,low,high in plan_range(begin, end, COARSEST_SPAN[group_by]):
+        if span == 'day':
+            parts.append('SELECT {} AS period, context, spent FROM time_spent WHERE date>=? AND date<=?'.format(
+                day_period_sql(group_by)))
+            params = params + [low, high]
+        else:
+            parts.append('SELECT {} AS period, context, spent FROM time_spent_rollup '
+                         'WHERE span=? AND bucket>=? AND bucket<=?'.format(bucket_period_sql(span, group_by)))
+            params = params + [span, low, high]
+
+    return ' UNION ALL '.join(parts), params
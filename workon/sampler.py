@@ -0,0 +1,171 @@
+import time
+from workon import config,storage,process,tracking
+
+SAMPLE_INTERVAL=30.0
+SAMPLE_FLUSH=10
+
+#
+# Resource sampler
+#
+# Runs inside the daemon. Every sample_interval seconds it takes a single
+# snapshot of /proc and charges the process tree of every application in
+# the current and hibernated contexts to its context: CPU time and I/O as
+# deltas since the previous sample, RSS as the sum over the tree. Totals
+# are accumulated in memory per context and day and written with one
+# executemany every sample_flush samples, and when the daemon stops.
+#
+# A process first seen by a sample is charged in full only if it started
+# after the previous sample; older processes only set the baseline.
+#
+# The CPU time and I/O counters of a process include its reaped children,
+# whose totals land in the parent when they exit. A child seen by the
+# previous sample has already been charged up to its totals then, so
+# those totals are taken off its parent's increase once the child is gone.
+#
+class Sampler:
+    def __init__(self, daemon):
+        self.daemon = daemon
+        self.last = {}
+        self.last_uptime = None
+        self.pending = {}
+        self.samples = 0
+        self.deadline = time.monotonic()
+        daemon.stop_hooks.append(self.flush)
+        daemon.call_later(0, self.sample)
+
+    def schedule(self, interval):
+        # Fixed cadence: the next sample is due one interval after the
+        # previous deadline, however long the sample itself took
+        self.deadline = max(self.deadline + interval, time.monotonic())
+        self.daemon.call_later(self.deadline - time.monotonic(), self.sample)
+
+    def sample(self):
+        session = config.get_session()
+        interval = session.cfg.get('sample_interval', SAMPLE_INTERVAL)
+        if not interval or interval <= 0:
+            # Disabled; check the configuration again later
+            self.last = {}
+            self.last_uptime = None
+            self.schedule(SAMPLE_INTERVAL)
+            return
+
+        try:
+            self.take_sample(session)
+            if self.samples >= session.cfg.get('sample_flush', SAMPLE_FLUSH):
+                self.flush()
+        finally:
+            self.schedule(interval)
+
+    def take_sample(self, session):
+        from workon import context
+
+        try:
+            current_context = context.read_current_context(session)
+        except (OSError, ValueError):
+            current_context = {}
+        contexts = {}
+        for ctx,apps in current_context.items():
+            contexts[ctx] = list(apps.values())
+        for ctx,entry in context.read_hibernated(session).items():
+            contexts.setdefault(ctx, []).extend(entry['apps'].values())
+
+        uptime = read_uptime()
+        procs = process.snapshot()
+        children = {}
+        groups = {}
+        for pid,(ppid,pgid,cpu,started,rss) in procs.items():
+            children.setdefault(ppid, []).append(pid)
+            groups.setdefault(pgid, []).append(pid)
+
+        # Totals last seen for the processes that have exited since, per
+        # nearest surviving ancestor: a child reaped by a parent that has
+        # exited too reaches the ancestor through the parent's totals
+        def gone(key):
+            return key in self.last and (key[0] not in procs or procs[key[0]][3] != key[1])
+
+        reaped = {}
+        for key,(cpu,read_bytes,write_bytes,parent) in self.last.items():
+            if gone(key) == False:
+                continue
+            while parent != None and gone(parent):
+                parent = self.last[parent][3]
+            if parent == None:
+                continue
+            totals = reaped.setdefault(parent, [0, 0, 0])
+            totals[0] = totals[0] + cpu
+            totals[1] = totals[1] + read_bytes
+            totals[2] = totals[2] + write_bytes
+
+        day = tracking.today()
+        seen = {}
+        for ctx,apps in contexts.items():
+            tree = set()
+            for info in apps:
+                pid = info[0]
+                if pid not in procs:
+                    continue
+                if len(info) > 2 and info[2] != None and procs[pid][3] != info[2]:
+                    continue
+                tree.update(process.process_tree(pid, procs, children, groups))
+
+            cpu_ticks = 0
+            rss_pages = 0
+            read_total = 0
+            write_total = 0
+            for pid in tree:
+                ppid,pgid,cpu,started,rss = procs[pid]
+                key = (pid, started)
+                if key in seen:
+                    continue
+                read_bytes,write_bytes = process.io_bytes(pid)
+                parent = (ppid, procs[ppid][3]) if ppid in procs else None
+                seen[key] = (cpu, read_bytes, write_bytes, parent)
+                rss_pages = rss_pages + rss
+
+                if key in self.last:
+                    prev_cpu,prev_read,prev_write = self.last[key][:3]
+                elif self.last_uptime != None and started >= self.last_uptime:
+                    prev_cpu,prev_read,prev_write = 0,0,0
+                else:
+                    continue
+                charged = reaped.get(key, (0, 0, 0))
+                cpu_ticks = cpu_ticks + max(0, cpu - prev_cpu - charged[0])
+                read_total = read_total + max(0, read_bytes - prev_read - charged[1])
+                write_total = write_total + max(0, write_bytes - prev_write - charged[2])
+
+            rss_bytes = rss_pages * process.PAGE_SIZE
+            usage = self.pending.setdefault((ctx, day), [0.0, 0, 0.0, 0, 0, 0])
+            usage[0] = usage[0] + cpu_ticks / process.CLK_TCK
+            usage[1] = max(usage[1], rss_bytes)
+            usage[2] = usage[2] + rss_bytes
+            usage[3] = usage[3] + 1
+            usage[4] = usage[4] + read_total
+            usage[5] = usage[5] + write_total
+
+        self.last = seen
+        self.last_uptime = uptime
+        self.samples = self.samples + 1
+
+    def flush(self):
+        if len(self.pending) == 0:
+            self.samples = 0
+            return
+
+        rows = []
+        for (ctx,day),(cpu,rss_peak,rss_total,samples,read_bytes,write_bytes) in self.pending.items():
+            rows.append((ctx, day, cpu, rss_peak, rss_total, samples, read_bytes, write_bytes))
+
+        with storage.transaction() as connection:
+            connection.executemany('INSERT INTO context_usage(context, date, cpu, rss_peak, rss_total, samples, '
+                                   'read_bytes, write_bytes) VALUES(?, ?, ?, ?, ?, ?, ?, ?) '
+                                   'ON CONFLICT(context, date) DO UPDATE SET cpu=cpu+excluded.cpu, '
+                                   'rss_peak=MAX(rss_peak, excluded.rss_peak), rss_total=rss_total+excluded.rss_total, '
+                                   'samples=samples+excluded.samples, read_bytes=read_bytes+excluded.read_bytes, '
+                                   'write_bytes=write_bytes+excluded.write_bytes', rows)
+        self.pending = {}
+        self.samples = 0
+
+def read_uptime():
+    # Clock ticks since boot, comparable with process start times
+    with open('/proc/uptime') as fp:
+        return int(float(fp.read().split()[0]) * process.CLK_TCK)
@@ -0,0 +1,303 @@
+#
+# Time tracking database schema
+#
+# The schema version is kept in PRAGMA user_version. Each migration brings
+# the database from the previous version to its own, so existing user
+# databases are upgraded in place the first time a newer workon opens them.
+#
+import fcntl
+
+MIGRATION_BATCH=5000
+
+def table_exists(connection, table):
+    res = connection.execute('SELECT 1 FROM sqlite_master WHERE type=? AND name=?', ('table', table))
+    return res.fetchone() != None
+
+def column_types(connection, table):
+    types = {}
+    for row in connection.execute('PRAGMA table_info({})'.format(table)):
+        types[row[1]] = row[2]
+    return types
+
+def copy_in_batches(connection, version, source, target_insert, batch=MIGRATION_BATCH):
+    # Copy rows from the legacy table in rowid order. Progress is committed
+    # with every batch, so an interrupted migration resumes where it stopped.
+    connection.execute('CREATE TABLE IF NOT EXISTS schema_migration(version INTEGER PRIMARY KEY, '
+                       'source TEXT NOT NULL, last_rowid INTEGER NOT NULL)')
+    connection.commit()
+
+    while True:
+        connection.execute('BEGIN IMMEDIATE')
+        res = connection.execute('SELECT last_rowid FROM schema_migration WHERE version=? AND source=?',
+                                 (version, source)).fetchone()
+        last_rowid = res[0] if res != None else 0
+
+        res = connection.execute('SELECT MAX(rowid) FROM (SELECT rowid FROM {} WHERE rowid>? '
+                                 'ORDER BY rowid LIMIT ?)'.format(source), (last_rowid, batch)).fetchone()
+        if res[0] == None:
+            connection.commit()
+            break
+
+        connection.execute(target_insert, (last_rowid, res[0]))
+        connection.execute('INSERT OR REPLACE INTO schema_migration(version, source, last_rowid) VALUES(?, ?, ?)',
+                           (version, source, res[0]))
+        connection.commit()
+
+#
+# Version 1: typed columns and covering indexes
+#
+def migrate_v1(connection):
+    if table_exists(connection, 'time_spent') and column_types(connection, 'time_spent').get('spent') != 'REAL':
+        connection.execute('CREATE TABLE IF NOT EXISTS time_spent_v1(context TEXT NOT NULL, date INTEGER NOT NULL, '
+                           'spent REAL NOT NULL DEFAULT 0, PRIMARY KEY(context, date)) WITHOUT ROWID')
+        connection.commit()
+        copy_in_batches(connection, 1, 'time_spent',
+                        'INSERT INTO time_spent_v1(context, date, spent) '
+                        'SELECT CAST(context AS TEXT), CAST(date AS INTEGER), CAST(spent AS REAL) FROM time_spent '
+                        'WHERE rowid>? AND rowid<=? '
+                        'ON CONFLICT(context, date) DO UPDATE SET spent=spent+excluded.spent')
+
+    if table_exists(connection, 'timer_sessions') and column_types(connection, 'timer_sessions').get('context') != 'TEXT':
+        connection.execute('CREATE TABLE IF NOT EXISTS timer_sessions_v1(id INTEGER PRIMARY KEY, '
+                           'context TEXT NOT NULL, start REAL NOT NULL, stop REAL)')
+        connection.commit()
+        copy_in_batches(connection, 1, 'timer_sessions',
+                        'INSERT OR IGNORE INTO timer_sessions_v1(id, context, start, stop) '
+                        'SELECT id, CAST(context AS TEXT), CAST(start AS REAL), CAST(stop AS REAL) '
+                        'FROM timer_sessions WHERE rowid>? AND rowid<=?')
+
+    connection.execute('BEGIN IMMEDIATE')
+    if table_exists(connection, 'time_spent_v1'):
+        connection.execute('DROP TABLE time_spent')
+        connection.execute('ALTER TABLE time_spent_v1 RENAME TO time_spent')
+    if table_exists(connection, 'timer_sessions_v1'):
+        connection.execute('DROP TABLE timer_sessions')
+        connection.execute('ALTER TABLE timer_sessions_v1 RENAME TO timer_sessions')
+
+    connection.execute('CREATE TABLE IF NOT EXISTS time_spent(context TEXT NOT NULL, date INTEGER NOT NULL, '
+                       'spent REAL NOT NULL DEFAULT 0, PRIMARY KEY(context, date)) WITHOUT ROWID')
+    connection.execute('DROP INDEX IF EXISTS time_spent_by_date')
+    connection.execute('CREATE INDEX time_spent_by_date ON time_spent(date, context, spent)')
+
+    connection.execute('CREATE TABLE IF NOT EXISTS timer_sessions(id INTEGER PRIMARY KEY, '
+                       'context TEXT NOT NULL, start REAL NOT NULL, stop REAL)')
+    connection.execute('DROP INDEX IF EXISTS timer_sessions_by_start')
+    connection.execute('DROP INDEX IF EXISTS timer_sessions_by_context')
+    connection.execute('CREATE INDEX timer_sessions_by_start ON timer_sessions(start, stop)')
+    connection.execute('CREATE INDEX timer_sessions_by_context ON timer_sessions(context, start)')
+
+    # Rollups are derived data; rebuild them from the typed daily rows
+    connection.execute('DROP TABLE IF EXISTS time_spent_rollup')
+    connection.execute('CREATE TABLE time_spent_rollup(span TEXT NOT NULL, bucket INTEGER NOT NULL, '
+                       'context TEXT NOT NULL, spent REAL NOT NULL DEFAULT 0, '
+                       'PRIMARY KEY(span, bucket, context)) WITHOUT ROWID')
+    from workon import rollup
+    connection.execute('INSERT INTO time_spent_rollup(span, bucket, context, spent) ' + rollup.expected_rollups_sql())
+
+    connection.execute('CREATE TABLE IF NOT EXISTS catalog(name TEXT PRIMARY KEY, archived INTEGER NOT NULL DEFAULT 0, '
+                       'last_access REAL NOT NULL DEFAULT 0, created REAL, mtime REAL)')
+    connection.execute('CREATE INDEX IF NOT EXISTS catalog_by_access ON catalog(archived, last_access)')
+    connection.execute('CREATE TABLE IF NOT EXISTS catalog_meta(key TEXT PRIMARY KEY, value)')
+
+    connection.execute('DROP TABLE IF EXISTS schema_migration')
+
+#
+# Version 2: application exits recorded by the supervisor
+#
+def migrate_v2(connection):
+    connection.execute('BEGIN IMMEDIATE')
+    connection.execute('CREATE TABLE IF NOT EXISTS app_exits(id INTEGER PRIMARY KEY, context TEXT NOT NULL, '
+                       'app TEXT NOT NULL, pid INTEGER NOT NULL, launched REAL, exited REAL NOT NULL, '
+                       'status INTEGER, restarted INTEGER NOT NULL DEFAULT 0)')
+    connection.execute('CREATE INDEX IF NOT EXISTS app_exits_by_context ON app_exits(context, exited)')
+
+#
+# Version 3: per-context resource usage from the sampler
+#
+def migrate_v3(connection):
+    connection.execute('BEGIN IMMEDIATE')
+    connection.execute('CREATE TABLE IF NOT EXISTS context_usage(context TEXT NOT NULL, date INTEGER NOT NULL, '
+                       'cpu REAL NOT NULL DEFAULT 0, rss_peak INTEGER NOT NULL DEFAULT 0, '
+                       'rss_total REAL NOT NULL DEFAULT 0, samples INTEGER NOT NULL DEFAULT 0, '
+                       'read_bytes INTEGER NOT NULL DEFAULT 0, write_bytes INTEGER NOT NULL DEFAULT 0, '
+                       'PRIMARY KEY(context, date)) WITHOUT ROWID')
+    connection.execute('CREATE INDEX IF NOT EXISTS context_usage_by_date ON context_usage(date, context)')
+
+#
+# Version 4: running state moves into the database
+#
+# The current context, hibernated contexts, timers and access history used
+# to be JSON files next to the database. They are imported once; the files
+# are renamed to <name>.imported after the migration has committed.
+#
+def read_legacy(directory, name):
+    import os
+    import json
+
+    try:
+        with open(os.path.join(directory, name)) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+def app_row(ctx, app, info, hibernated):
+    if isinstance(info, (int, float)):
+        info = [info]
+    info = list(info) + [None, None]
+    return (ctx, app, hibernated, int(info[0]), info[1], info[2])
+
+def migrate_v4(connection):
+    import os
+    from workon import config
+
+    connection.execute('BEGIN IMMEDIATE')
+    connection.execute('CREATE TABLE IF NOT EXISTS current_context(context TEXT PRIMARY KEY)')
+    connection.execute('CREATE TABLE IF NOT EXISTS hibernated(context TEXT PRIMARY KEY, since REAL NOT NULL)')
+    connection.execute('CREATE TABLE IF NOT EXISTS context_apps(context TEXT NOT NULL, app TEXT NOT NULL, '
+                       'hibernated INTEGER NOT NULL DEFAULT 0, pid INTEGER NOT NULL, launched REAL, start_time INTEGER, '
+                       'PRIMARY KEY(hibernated, context, app))')
+    connection.execute('CREATE TABLE IF NOT EXISTS timers(context TEXT PRIMARY KEY, started REAL NOT NULL)')
+    connection.execute('CREATE TABLE IF NOT EXISTS access_history(context TEXT PRIMARY KEY, last_access REAL NOT NULL)')
+
+    directory = os.path.dirname(connection.execute('PRAGMA database_list').fetchone()[2])
+    imported = []
+
+    current_context = read_legacy(directory, config.CURRENT_CONTEXT_FILE)
+    if isinstance(current_context, dict):
+        for ctx,apps in current_context.items():
+            connection.execute('INSERT OR IGNORE INTO current_context(context) VALUES(?)', (ctx,))
+            for app,info in apps.items():
+                connection.execute('INSERT OR REPLACE INTO context_apps(context, app, hibernated, pid, launched, start_time) '
+                                   'VALUES(?, ?, ?, ?, ?, ?)', app_row(ctx, app, info, 0))
+        imported.append(config.CURRENT_CONTEXT_FILE)
+
+    hibernated = read_legacy(directory, config.HIBERNATE_FILE)
+    if isinstance(hibernated, dict):
+        for ctx,entry in hibernated.items():
+            connection.execute('INSERT OR REPLACE INTO hibernated(context, since) VALUES(?, ?)', (ctx, entry['since']))
+            for app,info in entry['apps'].items():
+                connection.execute('INSERT OR REPLACE INTO context_apps(context, app, hibernated, pid, launched, start_time) '
+                                   'VALUES(?, ?, ?, ?, ?, ?)', app_row(ctx, app, info, 1))
+        imported.append(config.HIBERNATE_FILE)
+
+    timers = read_legacy(directory, config.TIMERS_FILE)
+    if isinstance(timers, dict):
+        for ctx,started in timers.items():
+            connection.execute('INSERT OR REPLACE INTO timers(context, started) VALUES(?, ?)', (ctx, float(started)))
+        imported.append(config.TIMERS_FILE)
+
+    hist = read_legacy(directory, config.HISTORY_FILE)
+    if isinstance(hist, dict):
+        for ctx,last_access in hist.items():
+            try:
+                last_access = float(last_access)
+            except ValueError:
+                continue
+            connection.execute('INSERT INTO access_history(context, last_access) VALUES(?, ?) '
+                               'ON CONFLICT(context) DO UPDATE SET last_access=MAX(last_access, excluded.last_access)',
+                               (ctx, last_access))
+        imported.append(config.HISTORY_FILE)
+
+    def retire():
+        for name in imported:
+            path = os.path.join(directory, name)
+            try:
+                os.replace(path, path + '.imported')
+            except OSError:
+                pass
+
+    return retire
+
+#
+# Version 5: access log and frecency ranking
+#
+# The frecency keys are computed from the access log on first use (see
+# history.ensure_frecency); the migration only seeds the log with the last
+# access of every context.
+#
+def migrate_v5(connection):
+    connection.execute('BEGIN IMMEDIATE')
+    if 'frecency' not in column_types(connection, 'access_history'):
+        connection.execute('ALTER TABLE access_history ADD COLUMN frecency REAL')
+    connection.execute('CREATE INDEX IF NOT EXISTS access_history_by_frecency ON access_history(frecency)')
+
+    connection.execute('CREATE TABLE IF NOT EXISTS access_log(id INTEGER PRIMARY KEY, '
+                       'context TEXT NOT NULL, ts REAL NOT NULL)')
+    connection.execute('CREATE INDEX IF NOT EXISTS access_log_by_context ON access_log(context, ts)')
+    connection.execute('DELETE FROM access_log')
+    connection.execute('INSERT INTO access_log(context, ts) SELECT context, last_access FROM access_history')
+    connection.execute('UPDATE access_history SET frecency=NULL')
+    connection.execute('DELETE FROM catalog_meta WHERE key=?', ('frecency_rate',))
+
+#
+# Version 6: trigram index for context name lookup
+#
+def migrate_v6(connection):
+    from workon import catalog
+
+    connection.execute('BEGIN IMMEDIATE')
+    connection.execute('CREATE TABLE IF NOT EXISTS context_trigrams(trigram TEXT NOT NULL, name TEXT NOT NULL, '
+                       'PRIMARY KEY(trigram, name)) WITHOUT ROWID')
+    connection.execute('CREATE INDEX IF NOT EXISTS context_trigrams_by_name ON context_trigrams(name)')
+    for (name,) in connection.execute('SELECT name FROM catalog').fetchall():
+        catalog.index_name(connection, name)
+
+#
+# Version 7: manifest of packed archives
+#
+def migrate_v7(connection):
+    connection.execute('BEGIN IMMEDIATE')
+    connection.execute('CREATE TABLE IF NOT EXISTS archive_manifest(name TEXT PRIMARY KEY, archived_at REAL NOT NULL, '
+                       'size INTEGER NOT NULL, packed_size INTEGER NOT NULL, files INTEGER NOT NULL, '
+                       'checksum TEXT NOT NULL) WITHOUT ROWID')
+
+#
+# Version 8: workspace snapshots
+#
+def migrate_v8(connection):
+    connection.execute('BEGIN IMMEDIATE')
+    connection.execute('CREATE TABLE IF NOT EXISTS snapshots(id INTEGER PRIMARY KEY, context TEXT NOT NULL, '
+                       'created REAL NOT NULL, files INTEGER NOT NULL, size INTEGER NOT NULL, '
+                       'new_bytes INTEGER NOT NULL)')
+    connection.execute('CREATE INDEX IF NOT EXISTS snapshots_by_context ON snapshots(context, id)')
+    connection.execute('CREATE TABLE IF NOT EXISTS snapshot_files(snapshot INTEGER NOT NULL, path TEXT NOT NULL, '
+                       'kind TEXT NOT NULL, mode INTEGER NOT NULL, size INTEGER NOT NULL, '
+                       'mtime_ns INTEGER NOT NULL, target TEXT, PRIMARY KEY(snapshot, path)) WITHOUT ROWID')
+
+MIGRATIONS=[
+    (1, migrate_v1),
+    (2, migrate_v2),
+    (3, migrate_v3),
+    (4, migrate_v4),
+    (5, migrate_v5),
+    (6, migrate_v6),
+    (7, migrate_v7),
+    (8, migrate_v8),
+]
+
+SCHEMA_VERSION=MIGRATIONS[-1][0]
+
+def schema_version(connection):
+    return connection.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(connection, db_file):
+    if schema_version(connection) >= SCHEMA_VERSION:
+        return
+
+    # Only one process migrates at a time; the others wait and then find
+    # the database already upgraded
+    with open(db_file + '.migrate', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        for version,migration in MIGRATIONS:
+            if schema_version(connection) < version:
+                after = migration(connection)
+                # The migration leaves its final transaction open, so the
+                # version bump commits atomically with it
+                if connection.in_transaction == False:
+                    connection.execute('BEGIN IMMEDIATE')
+                connection.execute('PRAGMA user_version={}'.format(version))
+                connection.commit()
+                # Clean-up that must only happen once the migration is durable
+                if after != None:
+                    after()
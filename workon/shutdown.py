@@ -0,0 +1,148 @@
+import os
+import time
+import signal
+from workon import config,process
+
+SHUTDOWN_GRACE=5.0
+KILL_WAIT=1.0
+POLL_INTERVAL=0.05
+
+#
+# Application shutdown
+#
+# Every application is checked against its recorded start time, then all
+# of them are sent SIGTERM at once. The shutdown waits for all of them
+# together, up to the grace period, and escalates to SIGKILL for whatever
+# is left. Waiting uses pidfds, which also work for processes started by
+# an earlier workon invocation.
+#
+def open_pidfd(pid):
+    try:
+        return os.pidfd_open(pid)
+    except ProcessLookupError:
+        return -1
+    except (AttributeError, OSError):
+        return None
+
+def wait_for_exit(pending, timeout, started, results, outcome):
+    import select
+
+    poller = select.poll()
+    fds = {}
+    polled = {}
+    remaining = {}
+    for name,pids in pending.items():
+        remaining[name] = set()
+        for pid in pids:
+            fd = open_pidfd(pid)
+            if fd == None:
+                polled[pid] = name
+                remaining[name].add(pid)
+            elif fd >= 0:
+                fds[fd] = (name, pid)
+                poller.register(fd, select.POLLIN)
+                remaining[name].add(pid)
+
+    deadline = time.monotonic() + timeout
+    while True:
+        for name in list(remaining):
+            if len(remaining[name]) == 0:
+                results[name] = (time.monotonic() - started, outcome)
+                del remaining[name]
+
+        wait = deadline - time.monotonic()
+        if len(remaining) == 0 or wait <= 0:
+            break
+        if len(polled) > 0:
+            wait = min(wait, POLL_INTERVAL)
+
+        for fd,event in poller.poll(wait * 1000):
+            name,pid = fds.pop(fd)
+            poller.unregister(fd)
+            os.close(fd)
+            remaining[name].discard(pid)
+
+        for pid,name in list(polled.items()):
+            if process.alive(pid) == False:
+                del polled[pid]
+                remaining[name].discard(pid)
+
+    for fd in fds:
+        os.close(fd)
+
+    left = {}
+    for name,pids in remaining.items():
+        left[name] = list(pids)
+    return left
+
+def send(apps, sig):
+    for name,info in apps.items():
+        try:
+            process.signal_app(info[0], sig)
+        except ProcessLookupError:
+            pass
+        except Exception as e:
+            print('Error signalling {} ({})'.format(name, e))
+
+def shutdown_apps(apps, grace=None, session=None, stopped=False):
+    if session is None:
+        session = config.get_session()
+    if grace == None:
+        grace = session.cfg.get('shutdown_grace', SHUTDOWN_GRACE)
+
+    results = {}
+    targets = {}
+    for name,info in apps.items():
+        if process.same_process(info):
+            targets[name] = info
+        elif process.alive(info[0]):
+            print('PID {} of {} belongs to another process, not signalling it'.format(info[0], display_name(name)))
+            results[name] = (0.0, 'reused')
+        else:
+            results[name] = (0.0, 'exited')
+
+    if len(targets) == 0:
+        return results
+
+    # Watch every process in each application's group, not just the leader
+    groups = process.process_groups()
+    pending = {}
+    for name,info in targets.items():
+        pid = info[0]
+        if process.is_group_leader(pid):
+            pending[name] = groups.get(pid, [pid])
+        else:
+            pending[name] = [pid]
+
+    started = time.monotonic()
+    send(targets, signal.SIGTERM)
+    if stopped:
+        # SIGTERM is only delivered to a stopped process once it continues
+        send(targets, signal.SIGCONT)
+
+    left = wait_for_exit(pending, grace, started, results, 'terminated')
+    if len(left) > 0:
+        for name,pids in left.items():
+            if process.same_process(targets[name]):
+                send({name: targets[name]}, signal.SIGKILL)
+            else:
+                # The leader is gone but members of its group remain
+                for pid in pids:
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except OSError:
+                        pass
+        left = wait_for_exit(left, KILL_WAIT, started, results, 'killed')
+        for name in left:
+            results[name] = (time.monotonic() - started, 'unresponsive')
+
+    return results
+
+def display_name(name):
+    if isinstance(name, tuple):
+        return '/'.join(name)
+    return name
+
+def print_results(results):
+    for name,(elapsed,outcome) in results.items():
+        print('{:.<32} {:7.3f}s ({})'.format(display_name(name), elapsed, outcome))
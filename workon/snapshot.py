@@ -0,0 +1,273 @@
+import os
+import stat
+import time
+import hashlib
+from workon import config,storage,state
+
+CHUNK_SIZE=4 * 1024 * 1024
+
+#
+# Workspace snapshots
+#
+# A snapshot records a context's definition and support directory. File
+# contents go to a content-addressed blob store (session.blob_dir): every
+# file is cut into CHUNK_SIZE chunks, each stored once under its sha256,
+# so identical files and unchanged chunks are shared between contexts and
+# between snapshots. The tree itself (paths, modes, mtimes, chunk lists
+# and link targets) is kept in the snapshots and snapshot_files tables.
+#
+# Snapshots are incremental: a file whose size and mtime match the
+# context's previous snapshot reuses its chunk list without being read.
+# Blobs are not reference-counted on disk; gc deletes the blobs no
+# snapshot refers to, after dropping all but the newest snapshot_keep
+# snapshots of each context when that is set. Snapshots and gc hold the
+# state lock, so gc never deletes a blob a snapshot is about to use.
+#
+def blob_path(session, digest):
+    return os.path.join(session.blob_dir, digest[:2], digest[2:])
+
+def worker_count(session):
+    return max(1, int(session.cfg.get('snapshot_threads', os.cpu_count() or 1)))
+
+def walk(context, session):
+    # (path, kind, mode, size, mtime_ns, link) relative to the context directory
+    entries = []
+
+    def add(path, st, link=None):
+        if stat.S_ISLNK(st.st_mode):
+            kind = 'l'
+        elif stat.S_ISDIR(st.st_mode):
+            kind = 'd'
+        elif stat.S_ISREG(st.st_mode):
+            kind = 'f'
+        else:
+            return False
+        entries.append((path, kind, stat.S_IMODE(st.st_mode), st.st_size, st.st_mtime_ns, link))
+        return kind == 'd'
+
+    def scan(relpath):
+        for entry in os.scandir(os.path.join(session.context_dir, relpath)):
+            path = os.path.join(relpath, entry.name)
+            st = entry.stat(follow_symlinks=False)
+            link = os.readlink(entry.path) if entry.is_symlink() else None
+            if add(path, st, link):
+                scan(path)
+
+    cfgname = os.path.basename(session.context_file(context))
+    add(cfgname, os.lstat(session.context_file(context)))
+    support_dir = session.support_dir(context)
+    if os.path.isdir(support_dir):
+        name = os.path.basename(support_dir)
+        add(name, os.lstat(support_dir))
+        scan(name)
+
+    return entries
+
+def store_file(filename, session):
+    import tempfile
+
+    chunks = []
+    new_bytes = 0
+    with open(filename, 'rb') as fp:
+        while True:
+            data = fp.read(CHUNK_SIZE)
+            if len(data) == 0 and len(chunks) > 0:
+                break
+            digest = hashlib.sha256(data).hexdigest()
+            chunks.append(digest)
+
+            path = blob_path(session, digest)
+            if os.path.exists(path) == False:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                fd,tmpfile = tempfile.mkstemp(prefix='.tmp-', dir=os.path.dirname(path))
+                with os.fdopen(fd, 'wb') as out:
+                    out.write(data)
+                os.replace(tmpfile, path)
+                new_bytes = new_bytes + len(data)
+
+            if len(data) < CHUNK_SIZE:
+                break
+
+    return (' '.join(chunks), new_bytes)
+
+def latest_files(connection, context):
+    res = connection.execute('SELECT MAX(id) FROM snapshots WHERE context=?', (context,)).fetchone()
+    files = {}
+    if res[0] == None:
+        return files
+    for path,size,mtime_ns,target in connection.execute(
+            'SELECT path, size, mtime_ns, target FROM snapshot_files WHERE snapshot=? AND kind=?', (res[0], 'f')):
+        files[path] = (size, mtime_ns, target)
+    return files
+
+def take_snapshot(context, session=None, verbose=True):
+    import concurrent.futures
+
+    if session is None:
+        session = config.get_session()
+    if os.path.exists(session.context_file(context)) == False:
+        print('Error taking snapshot: {} (no such context)'.format(context))
+        return None
+
+    started = time.monotonic()
+    connection = storage.get_connection(session)
+    with state.locked(session):
+        entries = walk(context, session)
+        previous = latest_files(connection, context)
+
+        # Only new or changed files are read and hashed
+        targets = {}
+        changed = []
+        for path,kind,mode,size,mtime_ns,link in entries:
+            if kind == 'l':
+                targets[path] = link
+            elif kind == 'f':
+                prev = previous.get(path)
+                if prev != None and prev[0] == size and prev[1] == mtime_ns:
+                    targets[path] = prev[2]
+                else:
+                    changed.append(path)
+
+        new_bytes = 0
+        with concurrent.futures.ThreadPoolExecutor(worker_count(session)) as pool:
+            futures = {}
+            for path in changed:
+                futures[path] = pool.submit(store_file, os.path.join(session.context_dir, path), session)
+            for path,future in futures.items():
+                targets[path],added = future.result()
+                new_bytes = new_bytes + added
+
+        size = sum(entry[3] for entry in entries if entry[1] == 'f')
+        with storage.transaction(session) as connection:
+            cursor = connection.execute('INSERT INTO snapshots(context, created, files, size, new_bytes) '
+                                        'VALUES(?, ?, ?, ?, ?)', (context, time.time(), len(entries), size, new_bytes))
+            snapshot_id = cursor.lastrowid
+            connection.executemany('INSERT INTO snapshot_files(snapshot, path, kind, mode, size, mtime_ns, target) '
+                                   'VALUES(?, ?, ?, ?, ?, ?, ?)',
+                                   [(snapshot_id, path, kind, mode, size, mtime_ns, targets.get(path))
+                                    for path,kind,mode,size,mtime_ns,link in entries])
+
+    if verbose:
+        print('Snapshot {} of {}: {} entries, {} changed, {:.1f} MiB new in {:.2f}s'.format(
+            snapshot_id, context, len(entries), len(changed), new_bytes / 1048576, time.monotonic() - started))
+    return snapshot_id
+
+def list_snapshots(context=None, session=None):
+    connection = storage.get_connection(session)
+    if context:
+        return connection.execute('SELECT id, context, created, files, size, new_bytes FROM snapshots '
+                                  'WHERE context=? ORDER BY id', (context,)).fetchall()
+    return connection.execute('SELECT id, context, created, files, size, new_bytes FROM snapshots '
+                              'ORDER BY context, id').fetchall()
+
+#
+# Restoring
+#
+# The snapshot is rebuilt in a staging directory inside the context
+# directory and then swapped in with renames. The current workspace is
+# snapshotted first, so a restore can itself be undone.
+#
+def build_tree(rows, staging, session):
+    directories = []
+    for path,kind,mode,size,mtime_ns,target in rows:
+        dest = os.path.join(staging, path)
+        if kind == 'd':
+            os.makedirs(dest, exist_ok=True)
+            directories.append((dest, mode, mtime_ns))
+        elif kind == 'l':
+            os.symlink(target, dest)
+        else:
+            with open(dest, 'wb') as out:
+                for digest in target.split():
+                    with open(blob_path(session, digest), 'rb') as fp:
+                        out.write(fp.read())
+            os.chmod(dest, mode)
+            os.utime(dest, ns=(mtime_ns, mtime_ns))
+
+    # Directory times last, after their contents were written
+    for dest,mode,mtime_ns in reversed(directories):
+        os.chmod(dest, mode)
+        os.utime(dest, ns=(mtime_ns, mtime_ns))
+
+def restore_snapshot(snapshot_id, session=None):
+    import shutil
+    import tempfile
+
+    if session is None:
+        session = config.get_session()
+
+    connection = storage.get_connection(session)
+    res = connection.execute('SELECT context FROM snapshots WHERE id=?', (snapshot_id,)).fetchone()
+    if res == None:
+        print('Error restoring snapshot: {} (no such snapshot)'.format(snapshot_id))
+        return
+    context = res[0]
+
+    # Paths sort parents before children
+    rows = connection.execute('SELECT path, kind, mode, size, mtime_ns, target FROM snapshot_files '
+                              'WHERE snapshot=? ORDER BY path', (snapshot_id,)).fetchall()
+    for path,kind,mode,size,mtime_ns,target in rows:
+        if kind == 'f':
+            for digest in target.split():
+                if os.path.exists(blob_path(session, digest)) == False:
+                    print('Error restoring snapshot: {} (missing blob for {})'.format(snapshot_id, path))
+                    return
+
+    with state.locked(session):
+        if os.path.exists(session.context_file(context)):
+            take_snapshot(context, session, verbose=False)
+
+        staging = tempfile.mkdtemp(prefix='.snapshot-{}.'.format(context), dir=session.context_dir)
+        try:
+            build_tree(rows, staging, session)
+            for name in (os.path.basename(session.context_file(context)),
+                         os.path.basename(session.support_dir(context))):
+                current = os.path.join(session.context_dir, name)
+                if os.path.lexists(current):
+                    os.rename(current, os.path.join(staging, name + '.replaced'))
+                if os.path.lexists(os.path.join(staging, name)):
+                    os.rename(os.path.join(staging, name), current)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    from workon import catalog
+    catalog.add_context(context, session)
+    print('Restored {} from snapshot {}'.format(context, snapshot_id))
+
+#
+# Garbage collection
+#
+def gc(session=None):
+    if session is None:
+        session = config.get_session()
+
+    keep = session.cfg.get('snapshot_keep')
+    with state.locked(session):
+        with storage.transaction(session) as connection:
+            if keep:
+                connection.execute('DELETE FROM snapshots WHERE id IN (SELECT id FROM (SELECT id, ROW_NUMBER() '
+                                   'OVER (PARTITION BY context ORDER BY id DESC) AS n FROM snapshots) WHERE n>?)',
+                                   (int(keep),))
+            connection.execute('DELETE FROM snapshot_files WHERE snapshot NOT IN (SELECT id FROM snapshots)')
+
+        referenced = set()
+        for (target,) in connection.execute('SELECT target FROM snapshot_files WHERE kind=?', ('f',)):
+            referenced.update(target.split())
+
+        removed = 0
+        freed = 0
+        try:
+            prefixes = os.listdir(session.blob_dir)
+        except FileNotFoundError:
+            prefixes = []
+        for prefix in prefixes:
+            directory = os.path.join(session.blob_dir, prefix)
+            for name in os.listdir(directory):
+                # Unfinished writes are left over temporary files
+                if name.startswith('.tmp-') or prefix + name not in referenced:
+                    path = os.path.join(directory, name)
+                    freed = freed + os.path.getsize(path)
+                    os.remove(path)
+                    removed = removed + 1
+
+    print('Removed {} unreferenced blob(s), {:.1f} MiB'.format(removed, freed / 1048576))
@@ -0,0 +1,114 @@
+import os
+import json
+import stat
+import fcntl
+import threading
+import contextlib
+from workon import config
+
+#
+# State files
+#
+# State files are replaced atomically: the new contents are written to a
+# temporary file in the same directory, flushed to disk and renamed over
+# the old file. A reader therefore always sees a complete file and never
+# needs a lock.
+#
+# Read-modify-write sequences run under an exclusive fcntl lock on the
+# context directory's lock file. There is one lock for all state files, so
+# an update spanning several files cannot deadlock, and it may be taken
+# again by the process already holding it. Hold it only around the state
+# change itself, never while waiting on applications.
+#
+# Parsed files are kept in memory for the life of the process and reused
+# while the file's stat stamp is unchanged, so a long-running daemon never
+# reparses an unchanged file. Callers get their own copy.
+#
+_cache = {}
+
+def file_stamp(path):
+    st = os.stat(path)
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def load(path):
+    import copy
+
+    stamp = file_stamp(path)
+    cached = _cache.get(path)
+    if cached == None or cached[0] != stamp:
+        with open(path) as fp:
+            data = json.load(fp)
+        cached = (stamp, data)
+        _cache[path] = cached
+
+    return copy.deepcopy(cached[1])
+
+def write_atomic(path, text, sync=True):
+    import tempfile
+
+    # mkstemp creates the file private; keep the mode of the file being
+    # replaced, or give a new file the usual mode
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+
+    directory,name = os.path.split(path)
+    fd,tmpfile = tempfile.mkstemp(prefix='.{}.'.format(name), suffix='.tmp', dir=directory)
+    try:
+        os.fchmod(fd, mode)
+        with os.fdopen(fd, 'w') as fp:
+            fp.write(text)
+            if sync:
+                fp.flush()
+                os.fsync(fp.fileno())
+        os.replace(tmpfile, path)
+    except:
+        try:
+            os.unlink(tmpfile)
+        except OSError:
+            pass
+        raise
+
+def store(path, data, indent=None):
+    import copy
+
+    write_atomic(path, json.dumps(data, indent=indent))
+
+    try:
+        _cache[path] = (file_stamp(path), copy.deepcopy(data))
+    except OSError:
+        _cache.pop(path, None)
+
+_lock = threading.RLock()
+_held = {}
+
+@contextlib.contextmanager
+def locked(session=None):
+    if session is None:
+        session = config.get_session()
+
+    lock_file = session.state_lock_file
+    with _lock:
+        entry = _held.get(lock_file)
+        if entry == None:
+            fp = open(lock_file, 'a')
+            try:
+                fcntl.flock(fp, fcntl.LOCK_EX)
+            except:
+                fp.close()
+                raise
+            entry = [fp, 0]
+            _held[lock_file] = entry
+        entry[1] = entry[1] + 1
+
+        try:
+            yield
+        finally:
+            entry[1] = entry[1] - 1
+            if entry[1] == 0:
+                del _held[lock_file]
+                fcntl.flock(entry[0], fcntl.LOCK_UN)
+                entry[0].close()
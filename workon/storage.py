@@ -0,0 +1,80 @@
+import atexit
+import contextlib
+from workon import config,schema
+
+BUSY_TIMEOUT=10.0
+
+#
+# Time tracking database connections
+#
+# One connection per database file is opened lazily and shared by every
+# module for the life of the process. The database runs in WAL mode with a
+# busy timeout, so concurrent workon invocations wait for each other instead
+# of failing with "database is locked". The schema is brought up to date
+# when the connection is opened.
+#
+_connections = {}
+
+def get_connection(session=None):
+    if session is None:
+        session = config.get_session()
+
+    db_file = session.time_track_db
+    connection = _connections.get(db_file)
+    if connection is None:
+        import sqlite3
+
+        timeout = session.cfg.get('db_busy_timeout', BUSY_TIMEOUT)
+        connection = sqlite3.connect(db_file, timeout=timeout)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        schema.migrate(connection, db_file)
+        _connections[db_file] = connection
+
+    return connection
+
+def close_connections():
+    for db_file,connection in list(_connections.items()):
+        try:
+            connection.close()
+        except Exception as e:
+            print(e)
+        del _connections[db_file]
+
+atexit.register(close_connections)
+
+#
+# Transactions
+#
+# transaction() runs a block as one write transaction (BEGIN IMMEDIATE, so
+# concurrent invocations queue on the busy timeout instead of failing on
+# upgrade). Transactions nest: only the outermost one commits, and commit()
+# does nothing while one is open, so functions that commit on their own
+# can also run as part of a larger transaction.
+#
+_depth = {}
+
+@contextlib.contextmanager
+def transaction(session=None):
+    connection = get_connection(session)
+    depth = _depth.get(connection, 0)
+    if depth == 0:
+        if connection.in_transaction:
+            connection.commit()
+        connection.execute('BEGIN IMMEDIATE')
+
+    _depth[connection] = depth + 1
+    try:
+        yield connection
+    except:
+        _depth[connection] = depth
+        if depth == 0:
+            connection.rollback()
+        raise
+    _depth[connection] = depth
+    if depth == 0:
+        connection.commit()
+
+def commit(connection):
+    if _depth.get(connection, 0) == 0:
+        connection.commit()
@@ -0,0 +1,199 @@
+import os
+import time
+from workon import config,storage,process,launcher
+
+RESTART_BACKOFF=1.0
+RESTART_BACKOFF_MAX=60.0
+RESTART_RESET=60.0
+
+#
+# Application supervisor
+#
+# Runs inside the daemon and watches every application of the current and
+# hibernated contexts through a pidfd registered on the daemon's selector,
+# so it costs nothing while the applications run. Each exit is recorded in
+# the app_exits table and the application is dropped from the saved state.
+#
+# An application whose definition sets "restart" to "on-failure" (or true)
+# or "always" is started again after an exponential backoff. The backoff
+# resets once the application has stayed up for RESTART_RESET seconds.
+# Exit statuses are only known for applications the daemon launched
+# itself; others are recorded with a NULL status and not restarted on
+# failure.
+#
+class Supervisor:
+    def __init__(self, daemon):
+        self.daemon = daemon
+        self.watched = {}
+        self.failures = {}
+        daemon.sync_hooks.append(self.sync)
+        daemon.child_owners.append(self.owns)
+
+    def owns(self, pid):
+        return pid in self.watched
+
+    def sync(self):
+        from workon import context
+
+        session = config.get_session()
+        try:
+            current_context = context.read_current_context(session)
+        except (OSError, ValueError):
+            current_context = {}
+        hibernated = context.read_hibernated(session)
+
+        for ctx,apps in current_context.items():
+            for app,info in apps.items():
+                self.watch(ctx, app, info)
+        for ctx,entry in hibernated.items():
+            for app,info in entry['apps'].items():
+                self.watch(ctx, app, info)
+
+    #
+    # Watching
+    #
+    def watch(self, ctx, app, info):
+        pid = info[0]
+        if pid in self.watched:
+            fd,old_ctx,old_app,old_info = self.watched[pid]
+            self.watched[pid] = (fd, ctx, app, info)
+            return
+
+        try:
+            fd = os.pidfd_open(pid)
+        except OSError:
+            # Exited before the daemon could watch it
+            self.exited(ctx, app, info, None)
+            return
+
+        if len(info) > 2 and info[2] != None and process.start_time(pid) != info[2]:
+            os.close(fd)
+            self.exited(ctx, app, info, None)
+            return
+
+        self.watched[pid] = (fd, ctx, app, info)
+        self.daemon.watch(fd, lambda fileobj, pid=pid: self.on_exit(pid))
+
+    def on_exit(self, pid):
+        fd,ctx,app,info = self.watched[pid]
+        self.daemon.unwatch(fd)
+        status = exit_status(fd)
+        os.close(fd)
+        del self.watched[pid]
+        launcher.forget(pid, status)
+
+        self.exited(ctx, app, info, status)
+        self.daemon.reap()
+
+    #
+    # Exits and restarts
+    #
+    def exited(self, ctx, app, info, status):
+        from workon import context
+
+        session = config.get_session()
+        now = time.time()
+
+        # Only applications still part of their context are dropped from
+        # the state or restarted; closed contexts are just recorded
+        removed = False
+        running = False
+        with storage.transaction(session):
+            try:
+                current_context = context.read_current_context(session)
+            except (OSError, ValueError):
+                current_context = {}
+            if ctx in current_context and same_entry(current_context[ctx].get(app), info):
+                del current_context[ctx][app]
+                context.write_current_context(current_context, session)
+                removed = True
+                running = True
+
+            hibernated = context.read_hibernated(session)
+            if ctx in hibernated and same_entry(hibernated[ctx]['apps'].get(app), info):
+                del hibernated[ctx]['apps'][app]
+                context.write_hibernated(hibernated, session)
+                removed = True
+
+        delay = None
+        if running:
+            delay = self.restart_delay(ctx, app, info, status, now, session)
+
+        if removed:
+            print('{}/{} (PID {}) exited with status {}'.format(ctx, app, info[0], status), flush=True)
+        record_exit(ctx, app, info, now, status, delay != None, session)
+
+        if delay != None:
+            print('Restarting {}/{} in {:.1f}s'.format(ctx, app, delay), flush=True)
+            self.daemon.call_later(delay, lambda: self.restart(ctx, app))
+
+    def restart_delay(self, ctx, app, info, status, now, session):
+        try:
+            spec = launcher.get_plan(ctx, session)['apps'].get(app)
+        except Exception:
+            return None
+        if spec == None:
+            return None
+
+        policy = spec.get('restart')
+        if policy == True:
+            policy = 'on-failure'
+        if policy == 'on-failure':
+            if status == None or status == 0:
+                return None
+        elif policy != 'always':
+            return None
+
+        key = (ctx, app)
+        if now - info[1] >= RESTART_RESET:
+            self.failures[key] = 0
+        failures = self.failures.get(key, 0)
+        self.failures[key] = failures + 1
+
+        backoff = session.cfg.get('restart_backoff', RESTART_BACKOFF)
+        backoff_max = session.cfg.get('restart_backoff_max', RESTART_BACKOFF_MAX)
+        return min(backoff * 2 ** failures, backoff_max)
+
+    def restart(self, ctx, app):
+        from workon import context
+
+        session = config.get_session()
+        spec = launcher.get_plan(ctx, session)['apps'].get(app)
+        if spec == None:
+            return
+
+        with storage.transaction(session):
+            current_context = context.read_current_context(session)
+            if ctx not in current_context or app in current_context[ctx]:
+                return
+
+            pid = launcher.spawn(spec)
+            info = [pid, time.time(), process.start_time(pid)]
+            current_context[ctx][app] = info
+            context.write_current_context(current_context, session)
+        self.watch(ctx, app, info)
+
+def same_entry(saved, info):
+    return saved != None and saved[0] == info[0]
+
+def exit_status(fd):
+    # The exit code, or the negated signal number for a killed process
+    try:
+        result = os.waitid(os.P_PIDFD, fd, os.WEXITED | os.WNOHANG)
+    except ChildProcessError:
+        return None
+    if result == None:
+        return None
+    if result.si_code == os.CLD_EXITED:
+        return result.si_status
+    return -result.si_status
+
+def record_exit(ctx, app, info, exited, status, restarted, session=None):
+    try:
+        connection = storage.get_connection(session)
+        connection.execute('INSERT INTO app_exits(context, app, pid, launched, exited, status, restarted) '
+                           'VALUES(?, ?, ?, ?, ?, ?, ?)',
+                           (ctx, app, info[0], info[1], exited, status, int(restarted)))
+        storage.commit(connection)
+    except Exception as e:
+        print('Error recording exit of {}/{}: {}'.format(ctx, app, e), flush=True)
@@ -1,75 +1,127 @@
-import os
-import json
 import time
-import sqlite3
-from datetime import datetime,date
-from workon import config
+from datetime import datetime,date,timedelta
+from workon import config,storage,rollup
 
-TIME_TRACK_DB='.time_track.db'
-TIMERS_FILE='.timers.json'
+TIME_TRACK_DB=config.TIME_TRACK_DB
 
 #
 # Time Spent Database
 #
-def create_time_spent_db():
-    cfg = config.read_config()
-    timer_db = os.path.join(cfg['context_dir'], TIME_TRACK_DB)
-    if os.path.exists(timer_db) == False:
-        connection = sqlite3.connect(timer_db)
-        cursor = connection.cursor()
-        cursor.execute('CREATE TABLE time_spent(context NOT NULL, date NOT NULL, spent, PRIMARY KEY(context,date))')
-        connection.commit()
-        connection.close()
-
-    timers_file = os.path.join(cfg['context_dir'], TIMERS_FILE)
-    if os.path.exists(timers_file) == False:
-        with open(timers_file, 'w') as fp:
-            json.dump(dict(), fp, indent=2)
-
-def today_is_in_db(context):
-    cfg = config.read_config()
-    timer_db = os.path.join(cfg['context_dir'], TIME_TRACK_DB)
+def connect(session=None):
+    return storage.get_connection(session)
 
-    try:
-        connection = sqlite3.connect(timer_db)
-        cursor = connection.cursor()
-        res = cursor.execute('SELECT count(*) FROM time_spent where context="{}" and date={}'.format(
-            context, date.today().strftime('%Y%m%d')))
-        occurrences = int(res.fetchone()[0])
-        connection.close()
-    except Exception as e:
-        print(e)
+def create_time_spent_db(session=None):
+    if session is None:
+        session = config.get_session()
 
-    in_db = False
-    if occurrences > 0:
-        in_db = True
+    connect(session)
 
-    return in_db
+def today():
+    return int(date.today().strftime('%Y%m%d'))
 
-def get_time_spent(context, begin=None, end=None):
-    today = date.today().strftime('%Y%m%d')
+def get_time_spent(context, begin=None, end=None, session=None):
     if begin == None:
-        begin = today
+        begin = today()
     if end == None:
-        end = today
+        end = today()
 
+    begin = int(begin)
+    end = int(end)
     if begin > end:
         begin = end
-    if end < begin:
-        end = begin
-
-    cfg = config.read_config()
-    timer_db = os.path.join(cfg['context_dir'], TIME_TRACK_DB)
-    connection = sqlite3.connect(timer_db)
-    cursor = connection.cursor()
-    command = 'SELECT SUM(spent) FROM time_spent where context="{}" and date>={} and date<={}'.format(
-        context, begin, end)
-    res = cursor.execute(command)
+
+    connection = connect(session)
+    source,params = rollup.range_source(begin, end)
+    res = connection.execute('SELECT SUM(spent) FROM ({}) WHERE context=?'.format(source), params + [context])
     time_spent = res.fetchone()[0]
-    connection.close()
 
     return time_spent
 
+def accumulate_time_spent(connection, context, day, elapsed):
+    connection.execute('INSERT INTO time_spent(context, date, spent) VALUES(?, ?, ?) '
+                       'ON CONFLICT(context, date) DO UPDATE SET spent=spent+excluded.spent',
+                       (context, day, elapsed))
+    rollup.record(connection, context, day, elapsed)
+
+def record_time_spent(context, elapsed, day=None, session=None):
+    if day == None:
+        day = today()
+
+    try:
+        connection = connect(session)
+        accumulate_time_spent(connection, context, day, elapsed)
+        storage.commit(connection)
+    except Exception as e:
+        print(e)
+
+#
+# Timer sessions
+#
+def split_by_day(start, stop):
+    # Split [start, stop) at local midnight boundaries
+    days = []
+    while start < stop:
+        day = datetime.fromtimestamp(start).date()
+        midnight = datetime.combine(day + timedelta(days=1), datetime.min.time()).timestamp()
+        end = min(stop, midnight)
+        days.append((int(day.strftime('%Y%m%d')), end - start))
+        start = end
+    return days
+
+def record_session(context, start, stop, session=None):
+    try:
+        connection = connect(session)
+        res = connection.execute('UPDATE timer_sessions SET start=?, stop=? WHERE context=? AND stop IS NULL',
+                                 (start, stop, context))
+        if res.rowcount == 0 and stop > start:
+            connection.execute('INSERT INTO timer_sessions(context, start, stop) VALUES(?, ?, ?)',
+                               (context, start, stop))
+
+        connection.execute('UPDATE catalog_meta SET value=MAX(value, ?) WHERE key=?',
+                           (stop - start, 'longest_session'))
+
+        for day,elapsed in split_by_day(start, stop):
+            accumulate_time_spent(connection, context, day, elapsed)
+        storage.commit(connection)
+    except Exception as e:
+        print(e)
+
+def open_session(context, start, session=None):
+    try:
+        connection = connect(session)
+        connection.execute('DELETE FROM timer_sessions WHERE context=? AND stop IS NULL', (context,))
+        connection.execute('INSERT INTO timer_sessions(context, start) VALUES(?, ?)', (context, start))
+        storage.commit(connection)
+    except Exception as e:
+        print(e)
+
+#
+# Sessions running at a point in time
+#
+# Closed sessions are found with a bounded range scan of the start index:
+# a session running at T started no earlier than T minus the longest
+# closed session, which is kept in catalog_meta. Running sessions are the
+# ones in the timers table.
+#
+def longest_session(connection):
+    res = connection.execute('SELECT value FROM catalog_meta WHERE key=?', ('longest_session',)).fetchone()
+    if res != None:
+        return res[0]
+
+    res = connection.execute('SELECT COALESCE(MAX(stop - start), 0) FROM timer_sessions '
+                             'WHERE stop IS NOT NULL').fetchone()
+    connection.execute('INSERT OR REPLACE INTO catalog_meta(key, value) VALUES(?, ?)', ('longest_session', res[0]))
+    storage.commit(connection)
+    return res[0]
+
+def running_at(timestamp, session=None):
+    connection = connect(session)
+    earliest = timestamp - longest_session(connection)
+    res = connection.execute('SELECT context FROM timer_sessions WHERE start>=? AND start<=? AND stop>? '
+                             'UNION SELECT context FROM timers WHERE started<=? ORDER BY context',
+                             (earliest, timestamp, timestamp, timestamp))
+    return [row[0] for row in res]
+
 def pretty_time_spent(seconds):
     seconds = int(seconds)
     #days, seconds = divmod(seconds, 86400)
@@ -88,72 +140,26 @@ def pretty_time_spent(seconds):
         return '%ds' % (seconds,)
     '''
 
-def read_timers():
-    cfg = config.read_config()
-    timers_file = os.path.join(cfg['context_dir'], TIMERS_FILE)
-    with open(timers_file) as fp:
-        timers = json.load(fp)
-    return timers
-
-def write_timers(timers):
-    cfg = config.read_config()
-    timers_file = os.path.join(cfg['context_dir'], TIMERS_FILE)
-    with open(timers_file, 'w') as fp:
-        json.dump(timers, fp, indent=2)
-
-def start_timer(context):
-    timers = read_timers()
-    timers[context] = time.time()
-    write_timers(timers)
-
-def stop_timer(context):
-    timers = read_timers()
-    current_time = time.time()
-
-    if context in timers.keys():
-        elapsed = current_time - timers[context]
-        del timers[context]
-    else:
-        elapsed = 0
-
-    write_timers(timers)
-
-    if today_is_in_db(context):
-        command = 'UPDATE time_spent SET spent=spent+{} where context="{}" and date={}'.format(
-            elapsed, context, date.today().strftime('%Y%m%d'))
-    else:
-        command = 'INSERT INTO time_spent VALUES("{}", {}, "{}")'.format(
-            context, date.today().strftime('%Y%m%d'), elapsed)
-        
-    cfg = config.read_config()
-    timer_db = os.path.join(cfg['context_dir'], TIME_TRACK_DB)
-
-    try:
-        connection = sqlite3.connect(timer_db)
-        cursor = connection.cursor()
-        cursor.execute(command)
-        connection.commit()
-        connection.close()
-    except Exception as e:
-        print(e)
-
-def add_time_spent(context, elapsed):
-    if today_is_in_db(context):
-        command = 'UPDATE time_spent SET spent=spent+{} where context="{}" and date={}'.format(
-            elapsed, context, date.today().strftime('%Y%m%d'))
-    else:
-        command = 'INSERT INTO time_spent VALUES("{}", {}, "{}")'.format(
-            context, date.today().strftime('%Y%m%d'), elapsed)
-        
-    cfg = config.read_config()
-    timer_db = os.path.join(cfg['context_dir'], TIME_TRACK_DB)
-
-    try:
-        connection = sqlite3.connect(timer_db)
-        cursor = connection.cursor()
-        cursor.execute(command)
-        connection.commit()
-        connection.close()
-    except Exception as e:
-        print(e)
+#
+# Running timers
+#
+def start_timer(context, session=None):
+    started = time.time()
+    with storage.transaction(session) as connection:
+        connection.execute('INSERT OR REPLACE INTO timers(context, started) VALUES(?, ?)', (context, started))
+        open_session(context, started, session)
 
+def stop_timer(context, session=None):
+    current_time = time.time()
+    with storage.transaction(session) as connection:
+        res = connection.execute('SELECT started FROM timers WHERE context=?', (context,)).fetchone()
+        if res != None:
+            start = res[0]
+            connection.execute('DELETE FROM timers WHERE context=?', (context,))
+        else:
+            start = current_time
+
+        record_session(context, start, current_time, session)
+
+def add_time_spent(context, elapsed, session=None):
+    record_time_spent(context, elapsed, session=session)